@@ -0,0 +1,257 @@
+#batch_classify.py
+
+import os
+import json
+import time
+import uuid
+import zlib
+import email.parser
+import email.policy
+import logging
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from openai import OpenAI
+from gpt_engine import estimate_image_tokens
+
+logger = logging.getLogger(__name__)
+
+# Classify through the Batch API (results within 24h, at half the price and outside the per-minute limits).
+BATCH_MODE = os.getenv("BATCH_MODE", "0") == "1"
+# Alternative API root for batch jobs, e.g. the local stand-in (python3 batch_classify.py stand-in).
+OPENAI_BATCH_BASE_URL = os.getenv("OPENAI_BATCH_BASE_URL")
+BATCH_DIR = os.getenv("BATCH_DIR", "batches")
+BATCH_POLL_INTERVAL = float(os.getenv("BATCH_POLL_INTERVAL", "60"))
+# Batch API limits per input file, with headroom on the size.
+BATCH_MAX_REQUESTS = 50000
+BATCH_MAX_BYTES = 180 * 1024 * 1024
+
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+class BatchJob:
+    """
+    Collects chat completion requests and runs them as Batch API jobs.
+
+    add() returns a concurrent.futures.Future per request; run() writes the requests to
+    JSONL files (split to stay within the Batch API limits), uploads and submits them,
+    polls until every batch is finished and resolves the futures with the answer text
+    (or the request's error).
+    """
+
+    def __init__(self, api_key=None, base_url=OPENAI_BATCH_BASE_URL, batch_dir=BATCH_DIR,
+                 poll_interval=BATCH_POLL_INTERVAL, ledger=None):
+        self.client = OpenAI(api_key=api_key, base_url=base_url)
+        self.batch_dir = batch_dir
+        self.poll_interval = poll_interval
+        # Optional UsageLedger that gets one entry per request
+        self.ledger = ledger
+        self._requests = []
+        self._futures = {}
+        self._image_tokens = {}
+
+    def add(self, body):
+        """
+        Queues one request.
+
+        :param body: chat.completions.create parameters (model, messages, ...).
+        :return: Future resolving to the response text once run() has finished.
+        """
+        custom_id = f"request-{len(self._requests) + 1}"
+        line = json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body})
+        self._requests.append(line)
+        self._image_tokens[custom_id] = estimate_image_tokens(body["messages"])
+        self._futures[custom_id] = Future()
+        return self._futures[custom_id]
+
+    def _write_files(self):
+        os.makedirs(self.batch_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        paths, chunk, size = [], [], 0
+        for line in self._requests + [None]:
+            if line is None or len(chunk) >= BATCH_MAX_REQUESTS or (chunk and size + len(line) + 1 > BATCH_MAX_BYTES):
+                if not chunk:
+                    break
+                path = os.path.join(self.batch_dir, f"batch_{stamp}_{len(paths) + 1}.jsonl")
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write("\n".join(chunk) + "\n")
+                paths.append(path)
+                chunk, size = [], 0
+            if line is not None:
+                chunk.append(line)
+                size += len(line) + 1
+        return paths
+
+    def _read_output(self, file_id):
+        if not file_id:
+            return
+        for line in self.client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            future = self._futures.get(result.get("custom_id"))
+            if future is None or future.done():
+                continue
+            response = result.get("response") or {}
+            body = response.get("body") or {}
+            if response.get("status_code") == 200:
+                future.set_result(body["choices"][0]["message"]["content"])
+            else:
+                error = result.get("error") or body.get("error") or response
+                future.set_exception(RuntimeError(f"Batch request failed: {error}"))
+            if self.ledger is not None:
+                usage = body.get("usage") or {}
+                self.ledger.record("batch_api", body.get("model"), usage.get("prompt_tokens"),
+                                   usage.get("completion_tokens"),
+                                   image_tokens=self._image_tokens.get(result.get("custom_id")), batch=True,
+                                   error=None if response.get("status_code") == 200 else str(error))
+
+    def run(self):
+        """Submits everything queued and blocks until all futures are resolved."""
+        if not self._requests:
+            return
+        batches = []
+        for path in self._write_files():
+            with open(path, "rb") as f:
+                uploaded = self.client.files.create(file=f, purpose="batch")
+            batch = self.client.batches.create(input_file_id=uploaded.id, endpoint="/v1/chat/completions",
+                                               completion_window="24h")
+            logger.info(f"Submitted batch {batch.id} from {path}")
+            batches.append(batch)
+
+        while True:
+            batches = [self.client.batches.retrieve(b.id) if b.status not in TERMINAL_STATUSES else b
+                       for b in batches]
+            done = sum(b.request_counts.completed + b.request_counts.failed for b in batches if b.request_counts)
+            logger.info(f"Batch progress: {done}/{len(self._requests)} requests, "
+                        f"statuses {', '.join(sorted({b.status for b in batches}))}")
+            if all(b.status in TERMINAL_STATUSES for b in batches):
+                break
+            time.sleep(self.poll_interval)
+
+        for batch in batches:
+            self._read_output(batch.output_file_id)
+            self._read_output(batch.error_file_id)
+            if batch.status != "completed":
+                logger.error(f"Batch {batch.id} ended as {batch.status}")
+        for custom_id, future in self._futures.items():
+            if not future.done():
+                future.set_exception(RuntimeError("No result in batch output"))
+                if self.ledger is not None:
+                    self.ledger.record("batch_api", None, batch=True, error="No result in batch output")
+        self._requests = []
+
+# Local stand-in for the Files and Batches endpoints, for testing batch mode without the API.
+
+def _stand_in_answer(body):
+    """Canned chat completion content: structured when a response schema is requested."""
+    checksum = zlib.crc32(json.dumps(body["messages"], sort_keys=True).encode("utf-8"))
+    verdict = "not good website" if checksum % 2 else "good website"
+    if body.get("response_format"):
+        schema = body["response_format"]["json_schema"]["schema"]
+        scores = {key: 3 for key in schema["properties"]["scores"]["required"]}
+        return json.dumps({"scores": scores, "verdict": verdict, "top_fixes": ["Stand-in fix"]})
+    return f"{verdict}\n- Stand-in classification"
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _json(self, payload, status=200):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _store_file(self, content, filename, purpose):
+        file_id = f"file-{uuid.uuid4().hex[:12]}"
+        self.server.files[file_id] = content
+        return {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                "filename": filename, "purpose": purpose, "status": "processed"}
+
+    def _batch(self, batch_id):
+        batch = self.server.batches[batch_id]
+        if batch["status"] == "in_progress" and time.time() - batch["created_at"] >= self.server.delay:
+            lines = self.server.files[batch["input_file_id"]].decode("utf-8").splitlines()
+            output = []
+            for line in filter(None, lines):
+                request = json.loads(line)
+                completion = {
+                    "id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "object": "chat.completion",
+                    "created": int(time.time()), "model": request["body"]["model"],
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": _stand_in_answer(request["body"])}}],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                }
+                output.append(json.dumps({"id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": request["custom_id"],
+                                          "response": {"status_code": 200, "body": completion}, "error": None}))
+            stored = self._store_file("\n".join(output).encode("utf-8"), "output.jsonl", "batch_output")
+            batch.update(status="completed", output_file_id=stored["id"], completed_at=int(time.time()),
+                         request_counts={"total": len(output), "completed": len(output), "failed": 0})
+        return batch
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.path == "/v1/files":
+            message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+                b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + body)
+            fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+            upload = fields["file"]
+            self._json(self._store_file(upload.get_payload(decode=True), upload.get_filename() or "batch.jsonl",
+                                        fields["purpose"].get_content().strip()))
+        elif self.path == "/v1/batches":
+            request = json.loads(body)
+            batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+            self.server.batches[batch_id] = {
+                "id": batch_id, "object": "batch", "endpoint": request["endpoint"],
+                "input_file_id": request["input_file_id"], "completion_window": request["completion_window"],
+                "status": "in_progress", "created_at": int(time.time()), "output_file_id": None,
+                "error_file_id": None, "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            }
+            self._json(self.server.batches[batch_id])
+        else:
+            self._json({"error": {"message": f"Unknown endpoint {self.path}"}}, 404)
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if parts[:2] == ["v1", "batches"] and len(parts) == 3 and parts[2] in self.server.batches:
+            self._json(self._batch(parts[2]))
+        elif parts[:2] == ["v1", "files"] and len(parts) == 4 and parts[3] == "content" \
+                and parts[2] in self.server.files:
+            content = self.server.files[parts[2]]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        else:
+            self._json({"error": {"message": f"Unknown endpoint {self.path}"}}, 404)
+
+def start_stand_in(port=0, delay=2):
+    """
+    Serves a minimal Files/Batches API on localhost that answers every request with a
+    canned classification after delay seconds.
+
+    :return: (server, base_url); set OPENAI_BATCH_BASE_URL to base_url and call
+             server.shutdown() when done.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), _StandInHandler)
+    server.daemon_threads = True
+    server.files, server.batches, server.delay = {}, {}, delay
+    threading.Thread(target=server.serve_forever, name="batch-stand-in", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2 or sys.argv[1] != "stand-in":
+        print("Usage: python3 batch_classify.py stand-in [port]")
+        sys.exit(1)
+    server, base_url = start_stand_in(int(sys.argv[2]) if len(sys.argv) > 2 else 8766)
+    print(f"Set OPENAI_BATCH_BASE_URL={base_url}; Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,124 @@
+#browser_cache.py
+
+import os
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; shards are then only safe for one capture process.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Persistent HTTP cache shared by capture browsers across sites and runs. Set to "" to disable.
+BROWSER_CACHE_DIR = os.getenv(
+    "BROWSER_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "searchagent", "http-cache"),
+)
+# Upper bound for the whole cache directory, and for the part one browser may fill.
+BROWSER_CACHE_MAX_MB = int(os.getenv("BROWSER_CACHE_MAX_MB", "2048"))
+BROWSER_CACHE_SHARD_MB = int(os.getenv("BROWSER_CACHE_SHARD_MB", "512"))
+
+# Chrome bookkeeping files that must stay put for the shard to remain readable.
+_KEEP_FILES = {"index", "the-real-index"}
+
+def _try_lock(path):
+    handle = open(path, "a")
+    if fcntl is None:
+        return handle
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return handle
+    except OSError:
+        handle.close()
+        return None
+
+def _unlock(handle):
+    if fcntl is not None:
+        fcntl.flock(handle, fcntl.LOCK_UN)
+    handle.close()
+
+def acquire_cache_shard(root=BROWSER_CACHE_DIR):
+    """
+    Reserves a cache shard for one Chrome process.
+
+    Chrome holds its disk cache open exclusively, so browsers cannot point at the same
+    directory at once. Instead the cache is split into shards under root; each running
+    browser locks one, and shards are reused by later browsers (and later runs), so common
+    CDN assets stay cached while cookies and storage live in each browser's own profile.
+
+    :param root: Cache root directory.
+    :return: (shard_dir, lock_handle). Pass lock_handle to release_cache_shard when the
+             browser exits.
+    """
+    os.makedirs(root, exist_ok=True)
+    index = 0
+    while True:
+        shard_dir = os.path.join(root, f"shard_{index}")
+        handle = _try_lock(f"{shard_dir}.lock")
+        if handle is not None:
+            os.makedirs(shard_dir, exist_ok=True)
+            prune_cache(root, owned=shard_dir)
+            return shard_dir, handle
+        index += 1
+
+def release_cache_shard(handle):
+    """Releases a shard reserved with acquire_cache_shard."""
+    if handle is not None and not handle.closed:
+        _unlock(handle)
+
+def _dir_files(path):
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            file_path = os.path.join(dirpath, name)
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            yield file_path, name, stat
+
+def prune_cache(root=BROWSER_CACHE_DIR, max_mb=BROWSER_CACHE_MAX_MB, owned=None):
+    """
+    Deletes least recently used cache entries until the cache fits in max_mb.
+
+    Only shards that no running browser holds are touched (plus ``owned``, the shard
+    the caller has just reserved and not yet handed to Chrome).
+
+    :return: Number of bytes freed.
+    """
+    max_bytes = max_mb * 1024 * 1024
+    total = 0
+    candidates = []
+    held_locks = []
+    try:
+        for name in sorted(os.listdir(root)):
+            shard_dir = os.path.join(root, name)
+            if not os.path.isdir(shard_dir):
+                continue
+            files = list(_dir_files(shard_dir))
+            total += sum(stat.st_size for _, _, stat in files)
+            if shard_dir != owned:
+                handle = _try_lock(f"{shard_dir}.lock")
+                if handle is None:
+                    continue  # in use by a running browser
+                held_locks.append(handle)
+            candidates.extend((max(stat.st_atime, stat.st_mtime), stat.st_size, path)
+                              for path, file_name, stat in files if file_name not in _KEEP_FILES)
+
+        if total <= max_bytes:
+            return 0
+
+        freed = 0
+        for _, size, path in sorted(candidates):
+            if total - freed <= max_bytes:
+                break
+            try:
+                os.remove(path)
+                freed += size
+            except OSError:
+                pass
+        logger.info(f"Pruned {freed / (1024 * 1024):.0f} MB from browser cache {root}")
+        return freed
+    finally:
+        for handle in held_locks:
+            _unlock(handle)
@@ -0,0 +1,270 @@
+#browser_pool.py
+
+import os
+import time
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from screenshot_capture import create_driver, close_driver
+from browser_cache import release_cache_shard
+
+try:
+    import psutil
+except ImportError:  # psutil is optional; RSS checks fall back to /proc, and are skipped without it (macOS).
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+# Pool tuning, overridable from the environment.
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "2"))
+BROWSER_MAX_PAGES = int(os.getenv("BROWSER_MAX_PAGES", "50"))       # retire a browser after this many captures
+BROWSER_MAX_RSS_MB = int(os.getenv("BROWSER_MAX_RSS_MB", "1500"))   # ...or once its process tree uses this much memory
+BROWSER_LEASE_TIMEOUT = int(os.getenv("BROWSER_LEASE_TIMEOUT", "120"))  # kill a browser held longer than this (hung)
+BROWSER_ACQUIRE_TIMEOUT = int(os.getenv("BROWSER_ACQUIRE_TIMEOUT", "180"))
+
+def _process_tree(pid):
+    """
+    Returns the pids of a process and all of its descendants, or [] where they cannot be
+    listed (no psutil and no /proc).
+
+    chromedriver is the process we own; Chrome and its renderers are its children.
+    """
+    if psutil is not None:
+        try:
+            parent = psutil.Process(pid)
+            return [pid] + [child.pid for child in parent.children(recursive=True)]
+        except psutil.Error:
+            return []
+
+    if not os.path.isdir("/proc"):
+        return []
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces, so split after the closing paren.
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, []))
+    return tree
+
+def _rss_mb(pid):
+    """Total resident memory, in MB, of a process and its descendants."""
+    total = 0
+    for child in _process_tree(pid):
+        if psutil is not None:
+            try:
+                total += psutil.Process(child).memory_info().rss
+            except psutil.Error:
+                pass
+            continue
+        try:
+            with open(f"/proc/{child}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            pass
+    return total / (1024 * 1024)
+
+def _driver_pid(driver):
+    try:
+        return driver.service.process.pid
+    except AttributeError:
+        return None
+
+def _kill_driver(driver):
+    """Hard-kills a driver's process tree. Used when Chrome is hung and quit() would block."""
+    pid = _driver_pid(driver)
+    if pid is not None:
+        for child in reversed(_process_tree(pid)):
+            try:
+                os.kill(child, 9)
+            except OSError:
+                pass
+    release_cache_shard(getattr(driver, "cache_shard_lock", None))
+
+class BrowserPool:
+    """
+    A fixed-size pool of long-lived headless Chrome drivers.
+
+    Callers borrow a driver per capture with ``pool.driver()``. Between borrowers the
+    driver's cookies and storage are wiped. Drivers are retired after BROWSER_MAX_PAGES
+    captures, once they exceed BROWSER_MAX_RSS_MB, or when they stop responding, and a
+    replacement is launched in the background so the batch keeps running.
+    """
+
+    def __init__(self, size=BROWSER_POOL_SIZE, max_pages=BROWSER_MAX_PAGES,
+                 max_rss_mb=BROWSER_MAX_RSS_MB, lease_timeout=BROWSER_LEASE_TIMEOUT):
+        self.size = size
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self.lease_timeout = lease_timeout
+
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._pages = {}    # id(driver) -> captures served
+        self._leases = {}   # id(driver) -> (driver, lease start time)
+        self._hung = set()  # id(driver) of leases killed by the watchdog
+        self._closed = False
+
+        logger.info(f"Starting browser pool with {size} drivers")
+        for _ in range(size):
+            self._spawn()
+
+        self._watchdog = threading.Thread(target=self._watch_leases, daemon=True)
+        self._watchdog.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _spawn(self):
+        threading.Thread(target=self._launch, daemon=True).start()
+
+    def _launch(self):
+        attempt = 0
+        while not self._closed:
+            attempt += 1
+            try:
+                driver = create_driver()
+            except Exception as e:
+                logger.error(f"Failed to launch pooled browser (attempt {attempt}): {str(e)}")
+                time.sleep(min(30, 2 ** attempt))
+                continue
+            if self._closed:
+                close_driver(driver)
+                return
+            with self._lock:
+                self._pages[id(driver)] = 0
+            self._idle.put(driver)
+            logger.debug(f"Pooled browser ready (pid {_driver_pid(driver)})")
+            return
+
+    def _retire(self, driver, reason):
+        logger.info(f"Retiring pooled browser (pid {_driver_pid(driver)}): {reason}")
+        with self._lock:
+            self._pages.pop(id(driver), None)
+
+        def replace():
+            try:
+                close_driver(driver)
+            except Exception:
+                _kill_driver(driver)
+            if not self._closed:
+                self._launch()
+
+        threading.Thread(target=replace, daemon=True).start()
+
+    def _watch_leases(self):
+        while not self._closed:
+            time.sleep(5)
+            now = time.time()
+            with self._lock:
+                stale = [(key, driver) for key, (driver, started) in self._leases.items()
+                         if now - started > self.lease_timeout and key not in self._hung]
+                for key, _ in stale:
+                    self._hung.add(key)
+            for _, driver in stale:
+                # Killing the processes makes the blocked WebDriver call raise in the borrower.
+                logger.warning(f"Pooled browser (pid {_driver_pid(driver)}) held for more than "
+                               f"{self.lease_timeout}s, killing it")
+                _kill_driver(driver)
+
+    def _wipe(self, driver):
+        """Clears cookies and site storage left by the previous capture. Returns False if the browser is unusable."""
+        try:
+            parts = urlsplit(driver.current_url)
+            for handle in driver.window_handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(driver.window_handles[0])
+            driver.get("about:blank")
+            driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+            if parts.scheme in ("http", "https"):
+                driver.execute_cdp_cmd("Storage.clearDataForOrigin", {
+                    "origin": f"{parts.scheme}://{parts.netloc}",
+                    "storageTypes": "all",
+                })
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to reset pooled browser: {str(e)}")
+            return False
+
+    def _release(self, driver):
+        key = id(driver)
+        with self._lock:
+            hung = key in self._hung
+            self._hung.discard(key)
+            self._pages[key] = self._pages.get(key, 0) + 1
+            pages = self._pages[key]
+
+        # The driver always goes back to the pool or is replaced, even if a check fails
+        try:
+            if self._closed:
+                self._retire(driver, "pool closed")
+            elif hung:
+                self._retire(driver, "hung")
+            elif not self._wipe(driver):
+                self._retire(driver, "unresponsive or crashed")
+            elif pages >= self.max_pages:
+                self._retire(driver, f"served {pages} pages")
+            else:
+                pid = _driver_pid(driver)
+                rss = _rss_mb(pid) if pid else 0
+                if rss > self.max_rss_mb:
+                    self._retire(driver, f"RSS {rss:.0f} MB exceeds {self.max_rss_mb} MB")
+                else:
+                    self._idle.put(driver)
+        except Exception as e:
+            self._retire(driver, f"health check failed: {str(e)}")
+        finally:
+            with self._lock:
+                self._leases.pop(key, None)
+
+    @contextmanager
+    def driver(self, timeout=BROWSER_ACQUIRE_TIMEOUT):
+        """
+        Borrows a driver for the duration of a ``with`` block.
+
+        :param timeout: Seconds to wait for a free driver before raising queue.Empty.
+        """
+        if self._closed:
+            raise RuntimeError("BrowserPool is closed")
+        driver = self._idle.get(timeout=timeout)
+        with self._lock:
+            self._leases[id(driver)] = (driver, time.time())
+        try:
+            yield driver
+        finally:
+            self._release(driver)
+
+    def close(self):
+        """Quits every idle driver. Drivers still on lease are quit when they are returned."""
+        if self._closed:
+            return
+        self._closed = True
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                close_driver(driver)
+            except Exception:
+                _kill_driver(driver)
+        logger.info("Browser pool closed")
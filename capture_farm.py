@@ -0,0 +1,145 @@
+#capture_farm.py
+
+import os
+import re
+import time
+import logging
+import multiprocessing
+from multiprocessing.util import Finalize
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Number of capture processes; 0 keeps captures in-process on the shared BrowserPool.
+CAPTURE_WORKERS = int(os.getenv("CAPTURE_WORKERS", "0"))
+# Total memory the farm's browsers may use, and the expected footprint of one worker's Chrome.
+CAPTURE_MEMORY_BUDGET_MB = int(os.getenv("CAPTURE_MEMORY_BUDGET_MB", "8192"))
+CAPTURE_WORKER_MB = int(os.getenv("CAPTURE_WORKER_MB", "700"))
+# Stop submitting new captures while the host has less than this much memory available.
+CAPTURE_MIN_FREE_MB = int(os.getenv("CAPTURE_MIN_FREE_MB", "1024"))
+
+# Per-process state, set up by _init_worker in each capture process.
+_worker_pool = None
+
+def unique_screenshot_path(output_dir, index, url, extension=".png"):
+    """
+    Builds a screenshot path that cannot collide with other sites in the same run.
+
+    :param output_dir: Directory the screenshot is written to.
+    :param index: Position of the site in the run (1-based).
+    :param url: The site URL; its host is folded into the filename for readability.
+    :param extension: File extension matching the screenshot format.
+    :return: e.g. "la_small_business/screenshot_12_example_com.png"
+    """
+    host = urlsplit(url if "://" in url else f"http://{url}").netloc or url
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", host).strip("_")[:60] or "site"
+    return os.path.join(output_dir, f"screenshot_{index}_{slug}{extension}")
+
+def available_memory_mb():
+    """Memory the host can still hand out, in MB, or None if it cannot be determined."""
+    try:
+        import psutil
+        return psutil.virtual_memory().available / (1024 * 1024)
+    except ImportError:
+        pass
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def plan_workers(requested=CAPTURE_WORKERS, budget_mb=CAPTURE_MEMORY_BUDGET_MB, worker_mb=CAPTURE_WORKER_MB):
+    """
+    Caps the requested worker count by CPU count and by the memory budget.
+
+    :return: Number of capture processes to start (at least 1).
+    """
+    workers = min(requested or os.cpu_count() or 1, os.cpu_count() or 1)
+    by_memory = max(1, budget_mb // worker_mb)
+    if by_memory < workers:
+        logger.warning(f"Limiting capture workers from {workers} to {by_memory} "
+                       f"to stay within {budget_mb} MB")
+        workers = by_memory
+    return max(1, workers)
+
+def _init_worker(max_rss_mb):
+    global _worker_pool
+    # Imported here so capture_farm itself does not pull in Selenium. Each spawned worker also
+    # re-imports the parent's main script (as __mp_main__), so that script must keep its
+    # module level cheap: classify_website creates its API clients in main().
+    from browser_pool import BrowserPool
+    from screenshot_capture import wait_for_saves
+    _worker_pool = BrowserPool(size=1, max_rss_mb=max_rss_mb)
+    Finalize(_worker_pool, _worker_pool.close, exitpriority=10)
+    # Screenshots are written in the background; finish them before the worker exits.
+    Finalize(_worker_pool, wait_for_saves, exitpriority=20)
+
+def _capture_task(index, url, output_path, time_budget):
+    from screenshot_capture import capture_screenshot, SITE_TIME_BUDGET
+    start_time = time.time()
+    capture, error = None, None
+    try:
+        capture = capture_screenshot(url, output_path, pool=_worker_pool,
+                                     time_budget=time_budget or SITE_TIME_BUDGET)
+    except Exception as e:
+        error = str(e) or e.__class__.__name__
+    return {
+        "index": index,
+        "url": url,
+        "path": output_path,
+        "capture": capture,
+        "error": error,
+        "seconds": time.time() - start_time,
+        "pid": os.getpid(),
+    }
+
+def capture_many(jobs, workers=CAPTURE_WORKERS, min_free_mb=CAPTURE_MIN_FREE_MB):
+    """
+    Captures many sites across a pool of isolated Chrome processes.
+
+    Results are yielded in completion order, so callers can start classifying the
+    first sites while the rest are still loading. At most two captures per worker
+    are queued at a time, and no new capture is submitted while host memory is
+    below min_free_mb.
+
+    :param jobs: Iterable of (index, url, output_path, time_budget) tuples. Output paths must be
+                 unique; a time_budget of None uses SITE_TIME_BUDGET. The iterable is consumed
+                 lazily, so a generator can size each budget at submission time.
+    :param workers: Requested number of capture processes; capped by plan_workers().
+    :param min_free_mb: Host memory floor below which submission pauses.
+    :return: Generator of result dicts with keys index, url, path, capture (the capture
+             record, or None on failure), error, seconds and pid.
+    """
+    workers = plan_workers(workers)
+    max_rss_mb = CAPTURE_MEMORY_BUDGET_MB // workers
+    logger.info(f"Starting capture farm with {workers} workers ({max_rss_mb} MB each)")
+
+    pending = iter(jobs)
+    in_flight = set()
+    exhausted = False
+    # spawn keeps each worker free of the parent's threads and open browser handles.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(max_rss_mb,)) as executor:
+        while in_flight or not exhausted:
+            while not exhausted and len(in_flight) < workers * 2:
+                free_mb = available_memory_mb()
+                if in_flight and free_mb is not None and free_mb < min_free_mb:
+                    logger.warning(f"Only {free_mb:.0f} MB available, waiting for running captures")
+                    break
+                try:
+                    job = next(pending)
+                except StopIteration:
+                    exhausted = True
+                    break
+                in_flight.add(executor.submit(_capture_task, *job))
+
+            if not in_flight:
+                continue
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
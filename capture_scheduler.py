@@ -0,0 +1,102 @@
+#capture_scheduler.py
+
+import os
+import time
+import logging
+from screenshot_capture import capture_screenshot, SITE_TIME_BUDGET
+from capture_farm import capture_many, plan_workers, CAPTURE_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Wall-clock seconds the whole run may spend capturing; 0 means no run-level limit.
+RUN_TIME_BUDGET = float(os.getenv("RUN_TIME_BUDGET", "0"))
+# A site is never given less than this, and a retry never more than RETRY_BUDGET_FACTOR x SITE_TIME_BUDGET.
+MIN_SITE_BUDGET = 5
+RETRY_BUDGET_FACTOR = 3
+
+def _capture(url, output_path, pool, time_budget):
+    try:
+        return capture_screenshot(url, output_path, pool=pool, time_budget=time_budget)
+    except Exception as e:
+        logger.error(f"Screenshot capture failed for {url}: {str(e)}")
+        return None
+
+def _run(jobs, pool, workers):
+    """Runs (index, url, output_path, time_budget) jobs and yields (index, capture) as they finish."""
+    if workers:
+        for result in capture_many(jobs, workers=workers):
+            if result["error"]:
+                logger.error(f"Screenshot capture failed for {result['url']}: {result['error']}")
+            yield result["index"], result["capture"]
+        return
+    for index, url, output_path, time_budget in jobs:
+        yield index, _capture(url, output_path, pool, time_budget)
+
+def schedule_captures(sites, pool=None, workers=CAPTURE_WORKERS, site_budget=SITE_TIME_BUDGET,
+                      run_budget=RUN_TIME_BUDGET):
+    """
+    Captures every site within a per-site and (optionally) a run-level time budget.
+
+    The first pass gives each site up to site_budget, shrinking it when the run budget
+    would not otherwise cover the sites still to come. Sites whose capture failed or
+    ran out of time are held back and, once every site has had its turn, retried with
+    the run's remaining time split among them. Completed captures are yielded as soon
+    as they are final.
+
+    :param sites: List of (index, url, output_path) tuples.
+    :param pool: BrowserPool for in-process captures (ignored when workers is set).
+    :param workers: Capture farm processes; 0 captures in-process.
+    :param site_budget: Seconds per site in the first pass.
+    :param run_budget: Seconds for all captures; 0 disables the run deadline and retries.
+    :return: Generator of (index, capture record or None) in completion order.
+    """
+    started = time.time()
+    run_deadline = started + run_budget if run_budget else None
+    parallel = plan_workers(workers) if workers else 1
+    by_index = {index: (url, output_path) for index, url, output_path in sites}
+
+    def budget_for(left, cap):
+        if run_deadline is None:
+            return cap
+        share = (run_deadline - time.time()) * parallel / max(1, left)
+        return max(MIN_SITE_BUDGET, min(cap, share))
+
+    def first_pass_jobs():
+        for position, (index, url, output_path) in enumerate(sites):
+            yield index, url, output_path, budget_for(len(sites) - position, site_budget)
+
+    pending = {}
+    for index, capture in _run(first_pass_jobs(), pool, workers):
+        if run_deadline and (capture is None or capture.get("timed_out")):
+            pending[index] = capture
+        else:
+            yield index, capture
+
+    if not pending:
+        return
+    if run_deadline - time.time() < MIN_SITE_BUDGET:
+        logger.info(f"Run time budget spent; keeping partial captures for {len(pending)} sites")
+        for index, capture in pending.items():
+            yield index, capture
+        return
+
+    logger.info(f"Retrying {len(pending)} slow or failed sites with {run_deadline - time.time():.0f}s left")
+    retry_order = sorted(pending)
+
+    def retry_jobs():
+        for position, index in enumerate(retry_order):
+            if run_deadline - time.time() < MIN_SITE_BUDGET:
+                return
+            url, output_path = by_index[index]
+            yield index, url, output_path, budget_for(len(retry_order) - position, site_budget * RETRY_BUDGET_FACTOR)
+
+    for index, capture in _run(retry_jobs(), pool, workers):
+        previous = pending.pop(index)
+        # Keep the earlier partial capture unless the retry did at least as well.
+        if capture is None or (capture.get("timed_out") and previous is not None):
+            capture = previous
+        yield index, capture
+
+    # Sites the run deadline left no time to retry
+    for index, capture in pending.items():
+        yield index, capture
@@ -0,0 +1,113 @@
+#classification_cache.py
+
+import os
+import json
+import time
+import base64
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Verdicts reused across runs, keyed by screenshot bytes, prompt, model and parameters. Set to "" to disable.
+CLASSIFICATION_CACHE_PATH = os.getenv(
+    "CLASSIFICATION_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "searchagent", "classifications.json"),
+)
+CLASSIFICATION_CACHE_TTL = int(os.getenv("CLASSIFICATION_CACHE_TTL", str(30 * 24 * 3600)))
+# Least recently used entries are evicted beyond this many.
+CLASSIFICATION_CACHE_MAX_ENTRIES = int(os.getenv("CLASSIFICATION_CACHE_MAX_ENTRIES", "20000"))
+# New entries written before the cache file is rewritten, so a crashed run keeps most of its results.
+SAVE_EVERY = 25
+
+def cache_key(messages, **params):
+    """
+    Content address of a classification request.
+
+    Hashes the system prompt, the bytes of every image and the request parameters
+    (model, temperature, max_tokens, ...). The user text is left out on purpose: it
+    carries per-load measurements (timings, request counts) that differ on every
+    capture of an unchanged page. Editing the system prompt changes every key, so
+    stale verdicts are never served.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    for message in messages:
+        content = message.get("content")
+        if message.get("role") == "system":
+            digest.update(b"system\0" + content.encode("utf-8"))
+            continue
+        for part in content if isinstance(content, list) else []:
+            if part.get("type") == "image_url":
+                data = part["image_url"]["url"].split(",", 1)[-1]
+                digest.update(b"image\0" + base64.b64decode(data))
+                digest.update(part["image_url"].get("detail", "auto").encode("utf-8"))
+    return digest.hexdigest()
+
+class ClassificationCache:
+    """
+    Persistent JSON map from cache_key() to a stored classification.
+
+    Entries expire after ttl seconds; beyond max_entries the least recently used ones
+    are dropped when the file is saved. Safe to use from several threads.
+    """
+
+    def __init__(self, path=CLASSIFICATION_CACHE_PATH, ttl=CLASSIFICATION_CACHE_TTL,
+                 max_entries=CLASSIFICATION_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        self._entries = {}
+        if path:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def get(self, key):
+        """The stored classification for key, or None."""
+        if not self.path:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry["created_at"] > self.ttl:
+                self.misses += 1
+                return None
+            entry["used_at"] = time.time()
+            self.hits += 1
+            return entry["result"]
+
+    def put(self, key, result):
+        if not self.path:
+            return
+        with self._lock:
+            now = time.time()
+            self._entries[key] = {"result": result, "created_at": now, "used_at": now}
+            self._unsaved += 1
+            save = self._unsaved >= SAVE_EVERY
+        if save:
+            self.save()
+
+    def save(self):
+        """Drops expired and least recently used entries and writes the cache file."""
+        if not self.path:
+            return
+        with self._lock:
+            now = time.time()
+            live = [(k, e) for k, e in self._entries.items() if now - e["created_at"] <= self.ttl]
+            live.sort(key=lambda item: item[1]["used_at"], reverse=True)
+            self._entries = dict(live[:self.max_entries])
+            self._unsaved = 0
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+        if self.hits:
+            logger.info(f"Classification cache: {self.hits} hits, {self.misses} misses")
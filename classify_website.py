@@ -1,13 +1,33 @@
 import os
 import base64
+import mimetypes
 import requests
 import csv
 import logging
 import time
+import re
+import json
+import asyncio
+from concurrent.futures import Future
 from datetime import datetime
 from dotenv import load_dotenv
-from screenshot_capture import capture_screenshot
-from apollo import get_contacts_from_apollo
+from screenshot_capture import (
+    capture_screenshot, wait_for_saves, CAPTURE_FORMAT, IMAGE_EXTENSIONS, DESKTOP_SIZE, MOBILE_SIZE,
+)
+from browser_pool import BrowserPool
+from capture_farm import unique_screenshot_path, CAPTURE_WORKERS
+from capture_scheduler import schedule_captures
+from preflight import preflight_urls, PREFLIGHT
+from junk_detector import detect_junk
+from gpt_engine import ClassificationEngine, estimate_tokens
+from usage_ledger import UsageLedger
+from classification_cache import ClassificationCache, cache_key
+from screenshot_clusters import ScreenshotClusters, CLUSTER_SCREENSHOTS
+from image_preprocess import preprocess_screenshots, log_preprocess_summary, IMAGE_DETAIL
+from batch_classify import BatchJob, BATCH_MODE
+from preclassifier import PreClassifier
+from text_first import TEXT_FIRST_MODE, render_outline, make_thumbnails, page_digest, log_text_first_summary
+from visual_features import FeatureTable, select_leads, FEATURE_NAMES, LEAD_FILTER, LEAD_RANK_BY
 
 # Set up detailed logging
 logging.basicConfig(
@@ -39,117 +59,377 @@ logger.info("OpenAI import complete")
 logger.info("Loading environment variables...")
 load_dotenv()
 
-# Initialize OpenAI client (new style)
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    logger.error("OPENAI_API_KEY environment variable is not set.")
-    raise ValueError("OPENAI_API_KEY environment variable is not set.")
-logger.info("API key loaded successfully")
+# API clients and run state, created by init_clients(). Capture farm workers (spawn) import this
+# module as __mp_main__ and must not pay for any of them.
+api_key = None
+client = None
+# Every model call of the run, with its tokens, cost, latency and retries
+ledger = None
+# Async client for classifications: bounded concurrency, RPM/TPM limiting and 429 backoff
+engine = None
+# Verdicts of unchanged screenshots are reused across runs
+classification_cache = None
+# Screenshots the locally trained model is confident about skip the API (inert until a model is trained)
+preclassifier = None
 
-client = OpenAI(api_key=api_key)  # New client initialization
+def init_clients():
+    """Creates the OpenAI clients, the usage ledger, the classification cache and the pre-classifier once."""
+    global api_key, client, ledger, engine, classification_cache, preclassifier
+    if engine is not None:
+        return
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        logger.error("OPENAI_API_KEY environment variable is not set.")
+        raise ValueError("OPENAI_API_KEY environment variable is not set.")
+    logger.info("API key loaded successfully")
 
-@timer_decorator
-def classify_website(website_url, screenshot_file="screenshot.png"):
-    logger.info(f"Processing website: {website_url}")
-    
-    # Capture screenshot
+    client = OpenAI(api_key=api_key)  # New client initialization
+    ledger = UsageLedger()
+    engine = ClassificationEngine(api_key=api_key, ledger=ledger)
+    classification_cache = ClassificationCache()
+    preclassifier = PreClassifier()
+
+# Screenshots per GPT-4o request; above 1, sites are classified in batches sharing one system prompt
+CLASSIFY_BATCH_SIZE = int(os.getenv("CLASSIFY_BATCH_SIZE", "1"))
+# Completion tokens allowed per site in a batched request
+BATCH_TOKENS_PER_SITE = 600
+BATCH_MAX_TOKENS = 4096
+
+# Triage runs stream each answer and stop at the verdict line; leads get their full explanation afterwards
+TRIAGE_MODE = os.getenv("TRIAGE_MODE", "0") == "1"
+TRIAGE_EXPLAIN_LEADS = os.getenv("TRIAGE_EXPLAIN_LEADS", "1") == "1"
+
+# Launch the capture browsers before the Apollo fetch so they are warm by the first site
+PREWARM_BROWSERS = os.getenv("PREWARM_BROWSERS", "1") == "1"
+
+# Evaluation criteria shared by the free-text and structured system prompts
+CRITERIA_PROMPT = (
+    "You are GPT-4o, an expert in evaluating modern business websites for user-centric design, "
+    "visual appeal, and effective UX. You will receive a screenshot of a website and analyze it "
+    "using the following criteria from 'Modern Business Website Design: Principles for Engagement "
+    "and UX':\n\n"
+    "1. **Visual Design**: Color usage and branding, cohesive palette, typography clarity/hierarchy, "
+    "   use of high-quality/optimized imagery, and sufficient whitespace.\n"
+    "2. **Layout & Structure**: Clear hierarchy of content, grid systems or alignment, effective use "
+    "   of whitespace, logical grouping of elements, and scannability.\n"
+    "3. **Navigation & Accessibility**: Intuitive menus, consistent navigation patterns, adequate "
+    "   color contrast, alt text on images, keyboard-friendly controls, and compliance with basic "
+    "   accessibility practices.\n"
+    "4. **Interactivity & Engagement**: Micro-interactions (hover states, button feedback), subtle "
+    "   animations/transition effects, and purposeful interactive features that enrich the user "
+    "   experience.\n"
+    "5. **Modern Trends**: Thoughtful inclusion of trends like dark mode, glassmorphism, "
+    "   neumorphism, AI personalization, or immersive/3D elements—only if they enhance usability.\n"
+    "6. **Conversion Optimization**: Placement and clarity of CTAs, trust signals (testimonials, "
+    "   security badges), streamlined form design, and overall persuasiveness.\n"
+    "7. **Mobile Optimization**: Fully responsive layout, legible touch targets, well-structured "
+    "   content on small screens, and minimal load times.\n"
+    "8. **UX Enhancements & Performance**: Fast page loads, intuitive user feedback (loading states, "
+    "   success/error messages), easily digestible content, and continuous improvement signals (e.g., "
+    "   A/B tested elements).\n\n"
+)
+
+# System prompt shared by every classification request
+SYSTEM_PROMPT = CRITERIA_PROMPT + (
+    "After examining the screenshot, you **must**:\n"
+    "- Begin your response with exactly one of these phrases on its own line: 'good website' or "
+    "  'not good website'.\n"
+    "- Follow that verdict with bullet points summarizing how well (or poorly) the site meets the "
+    "  above criteria.\n"
+    "- If you judge the site as 'not good website', identify the highest-priority fixes. Keep the "
+    "  focus on design, structure, UX, and performance aspects.\n\n"
+    "Your goal is to provide a concise but thorough analysis that references specific design "
+    "principles rather than just general impressions."
+)
+
+# Structured mode: a score per criterion, the verdict and the top fixes as JSON, in far fewer tokens
+STRUCTURED_MODE = os.getenv("STRUCTURED_MODE", "0") == "1"
+STRUCTURED_MAX_TOKENS = 300
+CRITERIA = {
+    "visual_design": "Visual Design",
+    "layout_structure": "Layout & Structure",
+    "navigation_accessibility": "Navigation & Accessibility",
+    "interactivity_engagement": "Interactivity & Engagement",
+    "modern_trends": "Modern Trends",
+    "conversion_optimization": "Conversion Optimization",
+    "mobile_optimization": "Mobile Optimization",
+    "ux_performance": "UX Enhancements & Performance",
+}
+STRUCTURED_SYSTEM_PROMPT = CRITERIA_PROMPT + (
+    "After examining the screenshot, score each of the eight criteria from 1 (poor) to 5 (excellent), "
+    "give the verdict 'good website' or 'not good website', and list up to three highest-priority fixes "
+    "(short phrases; none for a good website). Answer only with the JSON object described by the schema."
+)
+ASSESSMENT_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "website_assessment",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "scores": {
+                    "type": "object",
+                    "properties": {key: {"type": "integer", "description": "1 (poor) to 5 (excellent)"}
+                                   for key in CRITERIA},
+                    "required": list(CRITERIA),
+                    "additionalProperties": False,
+                },
+                "verdict": {"type": "string", "enum": ["good website", "not good website"]},
+                "top_fixes": {"type": "array", "items": {"type": "string"}},
+            },
+            "required": ["scores", "verdict", "top_fixes"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+def parse_assessment(classification):
+    """The structured-mode assessment dict in a classification, or None for free text."""
+    if not classification or not classification.lstrip().startswith("{"):
+        return None
+    try:
+        assessment = json.loads(classification)
+    except ValueError:
+        return None
+    return assessment if isinstance(assessment, dict) and "verdict" in assessment else None
+
+def render_assessment(assessment):
+    """Readable form of an assessment for the reports: the verdict line, then one bullet per score."""
+    lines = [assessment["verdict"]]
+    lines += [f"- {label}: {assessment['scores'].get(key, '?')}/5" for key, label in CRITERIA.items()]
+    if assessment.get("top_fixes"):
+        lines.append("- Top fixes: " + "; ".join(assessment["top_fixes"]))
+    return "\n".join(lines)
+
+def describe_page(page):
+    """
+    Turns the page signals from a capture into a few lines of measured facts, covering
+    what a screenshot cannot show (load speed, page weight, metadata, alt text).
+    """
+    def value(key, unit=""):
+        return "unknown" if page.get(key) is None else f"{page[key]}{unit}"
+
+    transferred = page.get("transfer_bytes")
+    lines = [
+        f"- Time to first byte: {value('ttfb_ms', ' ms')}; first contentful paint: {value('fcp_ms', ' ms')}; "
+        f"largest contentful paint: {value('lcp_ms', ' ms')}; load event: {value('load_event_ms', ' ms')}",
+        f"- Requests: {value('requests')}; transferred: "
+        f"{'unknown' if transferred is None else f'{transferred / 1024:.0f} KB'}",
+        f"- Meta description: {'present' if page.get('meta_description') else 'missing'}; "
+        f"viewport meta tag: {'present' if page.get('viewport_meta') else 'missing'}; "
+        f"H1 headings: {value('h1_count')}",
+        f"- Images with alt text: {value('images_with_alt')} of {value('images')}",
+    ]
+    return "\n".join(lines)
+
+def build_messages(encoded_image, image_mime="image/png", mobile_image=None, page=None, detail=None):
+    """
+    Builds the GPT-4o chat messages for one website.
+
+    :param encoded_image: Base64 desktop screenshot.
+    :param image_mime: MIME type of the screenshots.
+    :param mobile_image: Optional base64 screenshot of the same page on an emulated phone.
+    :param page: Optional page signals from the capture, added as measured facts.
+    :param detail: Optional vision detail ("low", "high" or "auto") for both images.
+    """
+    if mobile_image:
+        intro = (
+            f"Here are two screenshots of the same website: the first at desktop size ({DESKTOP_SIZE}), "
+            f"the second on an emulated phone ({MOBILE_SIZE}). Please evaluate it according to the modern "
+            "business web design best practices in your instructions, using the mobile screenshot for "
+            "mobile optimization. Then give a final verdict ('good website' or 'not good website') plus "
+            "bullet points explaining why."
+        )
+    else:
+        intro = (
+            "Here is a screenshot of a website. Please evaluate it according to the modern business "
+            "web design best practices in your instructions. Then give a final verdict ('good website' "
+            "or 'not good website') plus bullet points explaining why."
+        )
+    if page:
+        intro += ("\n\nMeasured while the screenshot was taken (use these for load speed and "
+                  "accessibility instead of guessing):\n" + describe_page(page))
+    def image_part(image):
+        image_url = {"url": f"data:{image_mime};base64,{image}"}
+        if detail:
+            image_url["detail"] = detail
+        return {"type": "image_url", "image_url": image_url}
+
+    content = [
+        {"type": "text", "text": intro},
+        image_part(encoded_image),
+    ]
+    if mobile_image:
+        content.append(image_part(mobile_image))
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": content},
+    ]
+
+def build_text_messages(page, thumbnail, thumbnail_mime="image/jpeg", mobile_thumbnail=None):
+    """
+    Builds text-first GPT-4o messages for one website: the page's visible text and outline,
+    with low-detail thumbnails for the overall look.
+
+    :param page: Page signals from the capture (text, outline and measurements).
+    :param thumbnail: Base64 thumbnail of the desktop screenshot.
+    :param thumbnail_mime: MIME type of the thumbnails.
+    :param mobile_thumbnail: Optional base64 thumbnail of the mobile screenshot.
+    """
+    thumbnails = ("small thumbnails of its first screen at desktop size and on an emulated phone"
+                  if mobile_thumbnail else "a small thumbnail of its first screen")
+    intro = (
+        f"Here are the visible text and an outline of a website's home page, with {thumbnails}. "
+        "Please evaluate it according to the modern business web design best practices in your "
+        "instructions: judge content, calls to action, trust signals and structure from the text and "
+        "outline, and the overall visual impression from the thumbnails. Then give a final verdict "
+        "('good website' or 'not good website') plus bullet points explaining why."
+        "\n\nMeasured while the page was loaded:\n" + describe_page(page)
+    )
+    outline = render_outline(page)
+    if outline:
+        intro += "\n\nPage outline (element, offset from the top of the page, text):\n" + outline
+    intro += f"\n\nVisible text ({page.get('word_count', 'unknown')} words in total):\n{page.get('text', '')}"
+    content = [{"type": "text", "text": intro}]
+    for image in filter(None, (thumbnail, mobile_thumbnail)):
+        content.append({"type": "image_url",
+                        "image_url": {"url": f"data:{thumbnail_mime};base64,{image}", "detail": "low"}})
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": content},
+    ]
+
+# Model and sampling parameters of every classification request (part of the cache key)
+CLASSIFY_PARAMS = {"model": "gpt-4o", "max_tokens": 1000, "temperature": 0.2}
+
+STRUCTURED_PARAMS = {**CLASSIFY_PARAMS, "max_tokens": STRUCTURED_MAX_TOKENS, "response_format": ASSESSMENT_SCHEMA}
+
+# Returned for sites whose screenshot could not be taken
+CAPTURE_FAILED_RESULT = "not good website\n- Unable to capture screenshot"
+
+def capture_site(website_url, screenshot_file, pool=None):
+    """Captures a website, returning its capture record or None if the capture failed."""
     start_time = time.time()
     logger.info(f"Capturing screenshot of {website_url}")
     try:
-        capture_screenshot(website_url, screenshot_file)
+        capture = capture_screenshot(website_url, screenshot_file, pool=pool)
         logger.info(f"Screenshot capture took {time.time() - start_time:.2f} seconds")
+        return capture
     except Exception as e:
         logger.error(f"Screenshot capture failed for {website_url}: {str(e)}")
-        return "not good website\n- Unable to capture screenshot"
+        return None
+
+def screen_capture(website_url, screenshot_file, capture, pool=None):
+    """
+    Checks a capture for junk (blank page, error page, parking page, cookie wall) before
+    it is sent to GPT-4o. Fixable junk is captured once more, with overlays dismissed or
+    extra time to render; the retried capture replaces the original record in place.
+
+    :return: A label such as "blank website\n- ..." for junk, or None if the capture is usable.
+    """
+    junk = detect_junk(capture)
+    if junk and junk["retry"]:
+        logger.info(f"Recapturing {website_url}: {junk['reason']}")
+        try:
+            retry = capture_screenshot(website_url, screenshot_file, pool=pool,
+                                       dismiss_overlays=junk["status"] == "blocked by overlay",
+                                       settle=2 if junk["status"] == "blank website" else 0)
+            capture.update(retry)
+            junk = detect_junk(capture)
+        except Exception as e:
+            logger.error(f"Recapture failed for {website_url}: {str(e)}")
+    if junk:
+        logger.info(f"Skipping classification of {website_url}: {junk['status']} ({junk['reason']})")
+        return f"{junk['status']}\n- {junk['reason']}"
+    return None
+
+def prepare_classification(website_url, screenshot_file="screenshot.png", pool=None, capture=None,
+                           text_first=False):
+    """
+    Captures (if needed) and screens a website and builds its GPT-4o messages.
+
+    With text_first, the messages carry the page text and outline plus low-detail thumbnails
+    (see build_text_messages) when the capture has page text, and the estimated prompt tokens
+    saved are recorded on the capture.
+
+    :return: (messages, None) when the site should be classified, or (None, result) when
+             it already has its result (capture failure, junk capture, unreadable screenshot).
+    """
+    # Capture screenshot unless the caller (or the capture farm) already did
+    if capture is None:
+        capture = capture_site(website_url, screenshot_file, pool=pool)
+        if capture is None:
+            return None, CAPTURE_FAILED_RESULT
+    
+    # Junk captures get a distinct label instead of an API call
+    if capture.get("image_b64"):
+        junk_result = screen_capture(website_url, screenshot_file, capture, pool=pool)
+        if junk_result:
+            return None, junk_result
+    
+    if text_first and capture.get("image_b64") and (capture.get("page") or {}).get("text"):
+        try:
+            desktop, mobile = make_thumbnails(capture)
+        except Exception as e:
+            logger.warning(f"Thumbnails failed for {website_url}, sending full screenshots: {str(e)}")
+        else:
+            messages = build_text_messages(capture["page"], desktop["image_b64"], desktop["mime"],
+                                           mobile and mobile["image_b64"])
+            tokens = estimate_tokens(messages)
+            image_tokens = estimate_tokens(build_messages(capture["image_b64"], capture["mime"],
+                                                          capture.get("mobile_image_b64"), capture["page"],
+                                                          detail=IMAGE_DETAIL))
+            capture["text_first"] = {"tokens": tokens, "tokens_saved": image_tokens - tokens}
+            logger.info(f"Text-first request for {website_url}: about {tokens} prompt tokens "
+                        f"instead of {image_tokens}")
+            return messages, None
     
-    # Encode image
+    # Use the encoded image straight from the capture; only fall back to the file on disk
     start_time = time.time()
-    if not os.path.exists(screenshot_file):
+    if capture.get("image_b64"):
+        encoded_image = capture["image_b64"]
+        image_mime = capture["mime"]
+    elif not os.path.exists(screenshot_file):
         error_msg = f"Screenshot file not found: {screenshot_file}"
         logger.error(error_msg)
-        return f"not good website\n- {error_msg}"
-        
+        return None, f"not good website\n- {error_msg}"
+    else:
+        try:
+            with open(screenshot_file, "rb") as image_file:
+                encoded_image = base64.b64encode(image_file.read()).decode("utf-8")
+            image_mime = mimetypes.guess_type(screenshot_file)[0] or "image/png"
+            logger.info(f"Image encoding took {time.time() - start_time:.2f} seconds")
+        except Exception as e:
+            logger.error(f"Image encoding failed: {str(e)}")
+            return None, "not good website\n- Failed to process screenshot"
+    
+    # Downscale, re-encode or crop as configured before the images are uploaded
     try:
-        with open(screenshot_file, "rb") as image_file:
-            encoded_image = base64.b64encode(image_file.read()).decode("utf-8")
-        logger.info(f"Image encoding took {time.time() - start_time:.2f} seconds")
+        desktop, mobile, stats = preprocess_screenshots(encoded_image, image_mime, capture.get("mobile_image_b64"))
     except Exception as e:
-        logger.error(f"Image encoding failed: {str(e)}")
-        return "not good website\n- Failed to process screenshot"
+        logger.warning(f"Image preprocessing failed for {website_url}, sending screenshots as captured: {str(e)}")
+        desktop, mobile, stats = {"image_b64": encoded_image, "mime": image_mime, "detail": None}, None, None
+    if stats:
+        capture["preprocess"] = stats
+        logger.info(f"Preprocessing saved {stats['bytes_saved']} bytes and {stats['tokens_saved']} image tokens "
+                    f"for {website_url}")
     
     # Prepare messages for GPT‑4o
-    messages = [
-    {
-        "role": "system",
-        "content": (
-            "You are GPT-4o, an expert in evaluating modern business websites for user-centric design, "
-            "visual appeal, and effective UX. You will receive a screenshot of a website and analyze it "
-            "using the following criteria from 'Modern Business Website Design: Principles for Engagement "
-            "and UX':\n\n"
-            "1. **Visual Design**: Color usage and branding, cohesive palette, typography clarity/hierarchy, "
-            "   use of high-quality/optimized imagery, and sufficient whitespace.\n"
-            "2. **Layout & Structure**: Clear hierarchy of content, grid systems or alignment, effective use "
-            "   of whitespace, logical grouping of elements, and scannability.\n"
-            "3. **Navigation & Accessibility**: Intuitive menus, consistent navigation patterns, adequate "
-            "   color contrast, alt text on images, keyboard-friendly controls, and compliance with basic "
-            "   accessibility practices.\n"
-            "4. **Interactivity & Engagement**: Micro-interactions (hover states, button feedback), subtle "
-            "   animations/transition effects, and purposeful interactive features that enrich the user "
-            "   experience.\n"
-            "5. **Modern Trends**: Thoughtful inclusion of trends like dark mode, glassmorphism, "
-            "   neumorphism, AI personalization, or immersive/3D elements—only if they enhance usability.\n"
-            "6. **Conversion Optimization**: Placement and clarity of CTAs, trust signals (testimonials, "
-            "   security badges), streamlined form design, and overall persuasiveness.\n"
-            "7. **Mobile Optimization**: Fully responsive layout, legible touch targets, well-structured "
-            "   content on small screens, and minimal load times.\n"
-            "8. **UX Enhancements & Performance**: Fast page loads, intuitive user feedback (loading states, "
-            "   success/error messages), easily digestible content, and continuous improvement signals (e.g., "
-            "   A/B tested elements).\n\n"
-            "After examining the screenshot, you **must**:\n"
-            "- Begin your response with exactly one of these phrases on its own line: 'good website' or "
-            "  'not good website'.\n"
-            "- Follow that verdict with bullet points summarizing how well (or poorly) the site meets the "
-            "  above criteria.\n"
-            "- If you judge the site as 'not good website', identify the highest-priority fixes. Keep the "
-            "  focus on design, structure, UX, and performance aspects.\n\n"
-            "Your goal is to provide a concise but thorough analysis that references specific design "
-            "principles rather than just general impressions."
-        )
-    },
-    {
-        "role": "user",
-        "content": [
-            {
-                "type": "text",
-                "text": (
-                    "Here is a screenshot of a website. Please evaluate it according to the modern business "
-                    "web design best practices in your instructions. Then give a final verdict ('good website' "
-                    "or 'not good website') plus bullet points explaining why."
-                )
-            },
-            {
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/png;base64,{encoded_image}"
-                }
-            }
-        ]
-    }
-]
-
+    mobile_image = mobile["image_b64"] if mobile else capture.get("mobile_image_b64")
+    return build_messages(desktop["image_b64"], desktop["mime"], mobile_image, capture.get("page"),
+                          detail=desktop["detail"]), None
 
-    
-    # API call
+async def request_classification(website_url, messages, key=None):
+    """
+    Runs on the engine's event loop: one GPT-4o call, turned into the classification text.
+    Successful results are stored in the classification cache under key.
+    """
     start_time = time.time()
-    logger.info("Preparing API call...")
+    logger.info(f"Requesting classification of {website_url}")
     try:
-        response = client.chat.completions.create(  # Updated API call syntax
-            model="gpt-4o",  # Updated model name
-            messages=messages,
-            max_tokens=1000,
-            temperature=0.2,
-        )
-        logger.info(f"API call took {time.time() - start_time:.2f} seconds")
+        response = await engine.create(stage="classify", messages=messages, **CLASSIFY_PARAMS)
+        logger.info(f"API call for {website_url} took {time.time() - start_time:.2f} seconds")
         
         classification_result = response.choices[0].message.content
         if not classification_result:
@@ -157,6 +437,8 @@ def classify_website(website_url, screenshot_file="screenshot.png"):
             return "not good website\n- Analysis failed due to empty API response"
             
         logger.info("Classification result received")
+        if key:
+            classification_cache.put(key, classification_result)
         return classification_result
         
     except Exception as e:
@@ -164,6 +446,329 @@ def classify_website(website_url, screenshot_file="screenshot.png"):
         logger.error(error_msg, exc_info=True)
         return f"not good website\n- Analysis failed: {error_msg}"
 
+def verdict_complete(text):
+    """True once the first line of a streamed answer is finished and holds a verdict."""
+    first, newline, _ = text.lstrip().partition("\n")
+    return bool(newline) and verdict_of(first) in ("good website", "not good website")
+
+async def request_verdict(website_url, messages, key=None):
+    """
+    Runs on the engine's event loop: streams a classification and returns as soon as the
+    verdict line is complete, cancelling the explanation.
+    """
+    start_time = time.time()
+    try:
+        text = await engine.create_until(verdict_complete, messages=messages, **CLASSIFY_PARAMS)
+    except Exception as e:
+        error_msg = f"Error in API call: {str(e)}"
+        logger.error(error_msg, exc_info=True)
+        return f"not good website\n- Analysis failed: {error_msg}"
+    logger.info(f"Verdict for {website_url} took {time.time() - start_time:.2f} seconds")
+    verdict = verdict_of(text)
+    if verdict not in ("good website", "not good website"):
+        # No clear verdict line; fall back to the full answer.
+        return await request_classification(website_url, messages)
+    if key:
+        classification_cache.put(key, verdict)
+    return verdict
+
+async def request_assessment(website_url, messages, key=None):
+    """
+    Runs on the engine's event loop: structured classification. Returns the assessment as a
+    JSON string (see parse_assessment), which the cache stores as is.
+    """
+    start_time = time.time()
+    try:
+        response = await engine.create(stage="structured", messages=messages, **STRUCTURED_PARAMS)
+        assessment = parse_assessment(response.choices[0].message.content)
+    except Exception as e:
+        error_msg = f"Error in API call: {str(e)}"
+        logger.error(error_msg, exc_info=True)
+        return f"not good website\n- Analysis failed: {error_msg}"
+    logger.info(f"Assessment of {website_url} took {time.time() - start_time:.2f} seconds")
+    if assessment is None:
+        logger.error(f"Unreadable structured response for {website_url}")
+        return "not good website\n- Analysis failed due to an unreadable structured response"
+    result = json.dumps(assessment)
+    if key:
+        classification_cache.put(key, result)
+    return result
+
+class ClassificationBatcher:
+    """
+    Packs several sites into one GPT-4o request.
+
+    Sites are queued with add() and sent together once size of them are waiting (or on
+    flush()). Each site is one labelled block of images in the request, and the answer
+    is split back into per-site classifications. Sites the answer leaves out, or gives
+    no clear verdict for, are resubmitted on their own.
+    """
+
+    def __init__(self, size=CLASSIFY_BATCH_SIZE):
+        self.size = size
+        self._items = []
+
+    def add(self, website_url, messages, key=None, page=None):
+        """Queues a site; returns a concurrent.futures.Future of its classification text."""
+        future = Future()
+        self._items.append({"url": website_url, "messages": messages, "key": key, "page": page, "future": future})
+        if len(self._items) >= self.size:
+            self.flush()
+        return future
+
+    def flush(self):
+        """Sends whatever is queued."""
+        if self._items:
+            engine.run(request_batch(self._items))
+            self._items = []
+
+def build_batch_messages(items):
+    intro = (
+        f"Here are screenshots of {len(items)} different websites. Each website starts with a label "
+        "'Site N: <url>' followed by its desktop screenshot and, if present, its mobile screenshot. "
+        "Evaluate every website independently according to the modern business web design best "
+        "practices in your instructions. For each website, in order, write a section that starts with "
+        "the line '### Site N', then the verdict ('good website' or 'not good website') on its own line, "
+        "then bullet points explaining why. Do not skip any website."
+    )
+    content = [{"type": "text", "text": intro}]
+    for number, item in enumerate(items, start=1):
+        images = [part for part in item["messages"][-1]["content"] if part["type"] == "image_url"]
+        label = f"Site {number}: {item['url']}"
+        if len(images) > 1:
+            label += f" (desktop {DESKTOP_SIZE}, then mobile {MOBILE_SIZE})"
+        if item["page"]:
+            label += "\nMeasured while the screenshot was taken:\n" + describe_page(item["page"])
+        content.append({"type": "text", "text": label})
+        content.extend(images)
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": content},
+    ]
+
+def split_batch_response(text, count):
+    """Splits a batched answer into {site number: section text} for numbers 1..count."""
+    sections = {}
+    parts = re.split(r"^\s*#+\s*Site\s+(\d+)\b.*$", text or "", flags=re.MULTILINE | re.IGNORECASE)
+    for number, section in zip(parts[1::2], parts[2::2]):
+        number = int(number)
+        if 1 <= number <= count and number not in sections:
+            sections[number] = section.strip()
+    return sections
+
+async def request_batch(items):
+    """Runs on the engine's event loop: classifies a batch and resolves each site's future."""
+    start_time = time.time()
+    sections = {}
+    try:
+        response = await engine.create(
+            stage="classify_batch",
+            messages=build_batch_messages(items),
+            **{**CLASSIFY_PARAMS, "max_tokens": min(BATCH_MAX_TOKENS, BATCH_TOKENS_PER_SITE * len(items))},
+        )
+        sections = split_batch_response(response.choices[0].message.content, len(items))
+        logger.info(f"Batch of {len(items)} sites took {time.time() - start_time:.2f} seconds")
+    except Exception as e:
+        logger.error(f"Batched classification failed, resubmitting {len(items)} sites individually: {str(e)}")
+
+    error = "batch was not resolved"
+    try:
+        missing = []
+        for number, item in enumerate(items, start=1):
+            section = sections.get(number)
+            if section and verdict_of(section) in ("good website", "not good website"):
+                item["future"].set_result(section)
+                if item["key"]:
+                    classification_cache.put(item["key"], section)
+            else:
+                missing.append(item)
+        if missing:
+            logger.warning(f"Batch answer had no verdict for {len(missing)} of {len(items)} sites, resubmitting them")
+            results = await asyncio.gather(*(request_classification(item["url"], item["messages"], item["key"])
+                                             for item in missing))
+            for item, result in zip(missing, results):
+                item["future"].set_result(result)
+    except Exception as e:
+        error = str(e)
+        logger.error(f"Resolving batched classifications failed: {error}", exc_info=True)
+    finally:
+        # main() waits on every future; none may be left unresolved
+        for item in items:
+            if not item["future"].done():
+                item["future"].set_result(f"not good website\n- Analysis failed: {error}")
+
+# Negated verdicts as GPT-4o phrases them: "not good website", "This is not a good website."
+NOT_GOOD = re.compile(r"\bnot\s+(?:a\s+)?good\b")
+
+def verdict_of(classification):
+    """The verdict on the first line of a classification: "good website", "not good website" or the line itself."""
+    assessment = parse_assessment(classification)
+    if assessment:
+        return assessment["verdict"]
+    lines = (classification or "").strip().splitlines()
+    first = lines[0].strip().lower() if lines else ""
+    if NOT_GOOD.search(first):
+        return "not good website"
+    return "good website" if "good website" in first else first
+
+async def _timed_request(messages):
+    start_time = time.time()
+    response = await engine.create(stage="compare", messages=messages, **CLASSIFY_PARAMS)
+    return response, time.time() - start_time
+
+def compare_requests(pairs, per_site=False):
+    """
+    A/B comparison of two ways of asking for the same classification.
+
+    :param pairs: List of (site, messages_a, messages_b). Both variants are sent (the
+                  classification cache is bypassed).
+    :param per_site: Also list each site's verdicts, prompt tokens and latency.
+    :return: dict with sites, agreement (fraction of matching verdicts), mean prompt
+             tokens and latency per variant, and the disagreeing sites with both verdicts.
+    """
+    futures = [(site, engine.run(_timed_request(a)), engine.run(_timed_request(b))) for site, a, b in pairs]
+    rows = []
+    for site, future_a, future_b in futures:
+        try:
+            (response_a, seconds_a), (response_b, seconds_b) = future_a.result(), future_b.result()
+        except Exception as e:
+            logger.error(f"A/B request failed for {site}: {str(e)}")
+            continue
+        rows.append({
+            "site": site,
+            "verdict_a": verdict_of(response_a.choices[0].message.content),
+            "verdict_b": verdict_of(response_b.choices[0].message.content),
+            "tokens_a": response_a.usage.prompt_tokens,
+            "tokens_b": response_b.usage.prompt_tokens,
+            "seconds_a": seconds_a,
+            "seconds_b": seconds_b,
+        })
+    count = max(1, len(rows))
+    report = {
+        "sites": len(rows),
+        "agreement": round(sum(r["verdict_a"] == r["verdict_b"] for r in rows) / count, 3),
+        "prompt_tokens_a": round(sum(r["tokens_a"] for r in rows) / count),
+        "prompt_tokens_b": round(sum(r["tokens_b"] for r in rows) / count),
+        "seconds_a": round(sum(r["seconds_a"] for r in rows) / count, 2),
+        "seconds_b": round(sum(r["seconds_b"] for r in rows) / count, 2),
+        "disagreements": [{"site": r["site"], "a": r["verdict_a"], "b": r["verdict_b"]}
+                          for r in rows if r["verdict_a"] != r["verdict_b"]],
+    }
+    if per_site:
+        report["per_site"] = [{**r, "tokens_saved": r["tokens_a"] - r["tokens_b"],
+                               "seconds_saved": round(r["seconds_a"] - r["seconds_b"], 2)} for r in rows]
+    return report
+
+def submit_batch_request(batch_job, website_url, messages, key=None, structured=False):
+    """
+    Queues a classification on a BatchJob. The returned future resolves like
+    request_classification's (or request_assessment's) once the job has run.
+    """
+    params = STRUCTURED_PARAMS if structured else CLASSIFY_PARAMS
+    answer = batch_job.add({"messages": messages, **params})
+    future = Future()
+
+    def finish(answer):
+        try:
+            classification_result = answer.result()
+            if structured:
+                assessment = parse_assessment(classification_result)
+                if assessment is None:
+                    raise ValueError("unreadable structured response")
+                classification_result = json.dumps(assessment)
+            if not classification_result:
+                raise ValueError("empty API response")
+        except Exception as e:
+            logger.error(f"Batch classification of {website_url} failed: {str(e)}")
+            future.set_result(f"not good website\n- Analysis failed: {str(e)}")
+            return
+        if key:
+            classification_cache.put(key, classification_result)
+        future.set_result(classification_result)
+
+    answer.add_done_callback(finish)
+    return future
+
+def submit_classification(website_url, screenshot_file="screenshot.png", pool=None, capture=None, clusters=None,
+                          batcher=None, triage=TRIAGE_MODE, structured=STRUCTURED_MODE, batch_job=None,
+                          text_first=TEXT_FIRST_MODE):
+    """
+    Starts classifying a website without waiting for GPT-4o. Screenshots the local
+    pre-classifier is confident about are decided without an API call.
+
+    :param clusters: Optional ScreenshotClusters; a site whose screenshot matches an earlier
+                     one shares that site's classification instead of making its own call.
+    :param batcher: Optional ClassificationBatcher to send the site as part of a batch. The
+                    caller must flush() it before waiting on the returned future.
+    :param triage: Only get the verdict line (streamed, the explanation is cancelled).
+                   Batching does not apply to triage requests.
+    :param structured: Get per-criterion scores, verdict and top fixes as JSON (the future
+                       resolves to the JSON string). Takes precedence over triage and batching.
+    :param batch_job: Optional BatchJob to send the request through the Batch API instead
+                      (triage and batching do not apply). The caller must run() it before
+                      waiting on the returned future.
+    :param text_first: Send the page text and outline with low-detail thumbnails instead of
+                       full screenshots. Batching does not apply to text-first requests.
+    :return: A concurrent.futures.Future resolving to the classification text.
+    """
+    logger.info(f"Processing website: {website_url}")
+    messages, result = prepare_classification(website_url, screenshot_file, pool=pool, capture=capture,
+                                              text_first=text_first)
+    if messages is None:
+        future = Future()
+        future.set_result(result)
+        return future
+    # Text-first requests never share cache entries with screenshot requests, and their key
+    # covers the page text and outline they are mostly made of
+    variant = {}
+    if text_first and capture and capture.get("text_first"):
+        variant = {"text_first": True, "page": page_digest(capture.get("page") or {})}
+    if variant:
+        batcher = None
+    if structured:
+        messages = [{"role": "system", "content": STRUCTURED_SYSTEM_PROMPT}] + messages[1:]
+        triage, batcher = False, None
+        key = cache_key(messages, **STRUCTURED_PARAMS, **variant)
+    else:
+        key = cache_key(messages, **CLASSIFY_PARAMS, **variant)
+    if batch_job is not None:
+        triage, batcher = False, None
+    cached = classification_cache.get(key)
+    if triage:
+        # A full classification from an earlier run serves triage too; verdict-only results have their own key.
+        key = cache_key(messages, **CLASSIFY_PARAMS, **variant, triage=True)
+        cached = cached if cached is not None else classification_cache.get(key)
+    image_b64 = capture.get("image_b64") if clusters is not None and capture else None
+    if cached is not None:
+        logger.info(f"Using cached classification for {website_url}")
+        future = Future()
+        future.set_result(cached)
+    else:
+        future = clusters.match(website_url, image_b64, capture.get("title")) if image_b64 else None
+        if future is not None:
+            return future
+        local_result = preclassifier.classify(website_url, capture.get("image_b64")) if capture else None
+        if local_result is not None:
+            future = Future()
+            future.set_result(local_result)
+        elif batch_job is not None:
+            future = submit_batch_request(batch_job, website_url, messages, key, structured)
+        elif structured:
+            future = engine.run(request_assessment(website_url, messages, key))
+        elif triage:
+            future = engine.run(request_verdict(website_url, messages, key))
+        elif batcher is not None:
+            future = batcher.add(website_url, messages, key, capture.get("page") if capture else None)
+        else:
+            future = engine.run(request_classification(website_url, messages, key))
+    if image_b64:
+        clusters.add(website_url, image_b64, future, capture.get("title"))
+    return future
+
+@timer_decorator
+def classify_website(website_url, screenshot_file="screenshot.png", pool=None, capture=None):
+    return submit_classification(website_url, screenshot_file, pool=pool, capture=capture).result()
+
 def generate_html_report(results, output_file):
     logger.info(f"Generating HTML report to {output_file}")
     html = [
@@ -174,6 +779,7 @@ def generate_html_report(results, output_file):
         "<style>",
         "body { font-family: Arial, sans-serif; }",
         "img { max-width: 600px; border: 1px solid #ccc; margin: 10px 0; }",
+        "img.mobile { max-width: 200px; margin-left: 10px; vertical-align: top; }",
         "h2 { color: #333; }",
         "</style>",
         "</head>",
@@ -181,10 +787,16 @@ def generate_html_report(results, output_file):
         "<h1>Website Classification Report</h1>",
     ]
     
-    for website, (screenshot_file, classification) in results.items():
+    for website, (screenshot_file, classification, capture) in results.items():
         logger.debug(f"Adding report entry for {website}")
         html.append(f"<h2>{website}</h2>")
-        if os.path.exists(screenshot_file):
+        if capture and capture.get("image_b64"):
+            # Reuse the image captured in memory instead of reading it back from disk
+            html.append(f'<img src="data:{capture["mime"]};base64,{capture["image_b64"]}" alt="Screenshot of {website}"/>')
+            if capture.get("mobile_image_b64"):
+                html.append(f'<img class="mobile" src="data:{capture["mime"]};base64,{capture["mobile_image_b64"]}" '
+                            f'alt="Mobile screenshot of {website}"/>')
+        elif os.path.exists(screenshot_file):
             # Read and encode the screenshot
             with open(screenshot_file, "rb") as img_file:
                 encoded_img = base64.b64encode(img_file.read()).decode("utf-8")
@@ -193,6 +805,13 @@ def generate_html_report(results, output_file):
             logger.warning(f"Screenshot not found for {website}")
             html.append("<p>[Screenshot not found]</p>")
         html.append(f"<p><strong>Classification:</strong> {classification}</p>")
+        if capture and "blocked_requests" in capture:
+            saved = capture["saved_ms"]
+            html.append(
+                f"<p><em>Capture: {capture['load_ms']} ms, {capture['blocked_requests']} third-party "
+                f"requests blocked, {'n/a' if saved is None else f'{saved} ms'} saved"
+                f"{'' if capture['saved_measured'] else ' (estimated)'}</em></p>"
+            )
         html.append("<hr/>")
     
     html.append("</body></html>")
@@ -205,8 +824,9 @@ def get_simplified_company_name(company_name):
     if not company_name:
         return ""
         
+    start_time = time.time()
     try:
-        response = client.chat.completions.create(
+        raw = client.chat.completions.with_raw_response.create(
             model="gpt-4",
             messages=[
                 {
@@ -221,15 +841,36 @@ def get_simplified_company_name(company_name):
             max_tokens=50,
             temperature=0
         )
+        response = raw.parse()
+        ledger.record("company_name", response.model, response.usage.prompt_tokens,
+                      response.usage.completion_tokens, seconds=time.time() - start_time,
+                      retries=getattr(raw, "retries_taken", 0))
         simplified_name = response.choices[0].message.content.strip()
         return simplified_name
     except Exception as e:
         logger.error(f"Error simplifying company name: {str(e)}")
+        ledger.record("company_name", "gpt-4", seconds=time.time() - start_time, error=str(e))
         return company_name.title()
 
-def write_csv_report(not_good_rows, csv_file):
+def write_csv_report(not_good_rows, csv_file, features=None):
     logger.info(f"Writing CSV report to {csv_file}")
     fieldnames = ["website", "company_name", "first_name", "last_name", "email", "location"]
+    if any("score" in row for row in not_good_rows):
+        # Structured runs: weakest sites first
+        fieldnames.append("score")
+        not_good_rows = sorted(not_good_rows, key=lambda row: row.get("score", float("inf")))
+    if features is not None and len(features):
+        # Visual profiles from the feature table: extra columns, and LEAD_FILTER / LEAD_RANK_BY if set
+        fieldnames += FEATURE_NAMES
+        if LEAD_FILTER or LEAD_RANK_BY:
+            # Select and rank websites, then keep every contact of a selected website in that order
+            sites = list(dict.fromkeys(row["website"] for row in not_good_rows))
+            rank = {site: i for i, site in enumerate(select_leads(sites, features))}
+            selected = sorted((row for row in not_good_rows if row["website"] in rank),
+                              key=lambda row: rank[row["website"]])
+            logger.info(f"Lead filter kept {len(selected)} of {len(not_good_rows)} leads")
+            not_good_rows = selected
+        not_good_rows = [{**row, **(features.get(row["website"]) or {})} for row in not_good_rows]
     try:
         with open(csv_file, "w", newline="", encoding="utf-8") as f:
             writer = csv.DictWriter(f, fieldnames=fieldnames)
@@ -243,6 +884,41 @@ def write_csv_report(not_good_rows, csv_file):
     except Exception as e:
         logger.error(f"Error writing CSV report: {str(e)}", exc_info=True)
 
+def log_blocking_summary(captures):
+    blocked = [c for c in captures if c and "blocked_requests" in c]
+    if not blocked:
+        return
+    total_requests = sum(c["blocked_requests"] for c in blocked)
+    saved = [c["saved_ms"] for c in blocked if c["saved_ms"] is not None]
+    measured = [c["saved_ms"] for c in blocked if c["saved_measured"]]
+    logger.info(f"Request blocking: {total_requests} requests blocked across {len(blocked)} sites, "
+                f"~{sum(saved) / 1000:.1f} s of load time saved "
+                f"({len(measured)} sites measured, {len(saved) - len(measured)} estimated)")
+
+def record_result(contact, screenshot_file, classification, capture, results, not_good_rows):
+    website = contact["website"]
+    # Structured assessments are decided on their exact verdict field and shown as readable text
+    assessment = parse_assessment(classification)
+    is_lead = verdict_of(classification) == "not good website" if assessment else \
+        bool(classification and NOT_GOOD.search(classification.lower()))
+    if assessment:
+        classification = render_assessment(assessment)
+    results[website] = (screenshot_file, classification, capture)
+    
+    if is_lead:
+        row = {
+            "website": website,
+            "company_name": contact.get("company_name", ""),
+            "first_name": contact.get("first_name", ""),
+            "last_name": contact.get("last_name", ""),
+            "email": contact.get("email", ""),
+            "location": contact.get("location", "")
+        }
+        if assessment:
+            # Sum of the eight criterion scores (8-40); lower means a weaker site and a stronger lead
+            row["score"] = sum(assessment["scores"].values())
+        not_good_rows.append(row)
+
 @timer_decorator
 def main():
     # Get number of websites from command line argument
@@ -257,15 +933,17 @@ def main():
         sys.exit(1)
 
     logger.info("Starting main process")
+    init_clients()
+    # Imported here: apollo requires APOLLO_API_KEY, which capture workers have no use for
+    from apollo import get_contacts_from_apollo, CURRENT_LIST_NAME
+    
+    pool = BrowserPool() if PREWARM_BROWSERS and not CAPTURE_WORKERS else None
     
     start_time = time.time()
     contacts = get_contacts_from_apollo()
     logger.info(f"Apollo API call took {time.time() - start_time:.2f} seconds")
     logger.info(f"Retrieved {len(contacts)} contacts")
     
-    # Get the list name from apollo.py
-    from apollo import CURRENT_LIST_NAME
-    
     # Create screenshots directory if it doesn't exist
     screenshots_dir = CURRENT_LIST_NAME
     os.makedirs(screenshots_dir, exist_ok=True)
@@ -274,23 +952,83 @@ def main():
     results = {}
     not_good_rows = []
     
-    for i, contact in enumerate(contacts[:num_websites], start=1):
-        website = contact["website"]
-        screenshot_file = f"{screenshots_dir}/screenshot_{i}.png"
-        logger.info(f"Processing website {i}/{num_websites}: {website}")
-        
-        classification = classify_website(website, screenshot_file=screenshot_file)
-        results[website] = (screenshot_file, classification)
-        
-        if classification and "not good" in classification.lower():
-            not_good_rows.append({
-                "website": website,
-                "company_name": contact.get("company_name", ""),
-                "first_name": contact.get("first_name", ""),
-                "last_name": contact.get("last_name", ""),
-                "email": contact.get("email", ""),
-                "location": contact.get("location", "")
-            })
+    sites = contacts[:num_websites]
+    paths = {
+        i: unique_screenshot_path(screenshots_dir, i, contact["website"], IMAGE_EXTENSIONS[CAPTURE_FORMAT])
+        for i, contact in enumerate(sites, start=1)
+    }
+    
+    # Check DNS, TLS, redirects and status codes for every site before launching any browser.
+    # Dead and parked domains get their own status instead of becoming leads.
+    checks = preflight_urls([contact["website"] for contact in sites]) if PREFLIGHT else {}
+    jobs = []
+    for i, contact in enumerate(sites, start=1):
+        check = checks.get(contact["website"])
+        if check and not check["reachable"]:
+            logger.info(f"Skipping {contact['website']}: {check['status']} {check['detail']}")
+            record_result(contact, paths[i], f"unreachable website\n- {check['status']}: {check['detail']}",
+                          None, results, not_good_rows)
+        else:
+            jobs.append((i, check["final_url"] if check else contact["website"], paths[i]))
+    
+    # Reuse a small set of warm browsers instead of launching Chrome for every site,
+    # unless the capture farm runs browsers in its own processes
+    if pool is None and not CAPTURE_WORKERS:
+        pool = BrowserPool()
+    pending = []
+    # Near-identical screenshots (shared templates, franchise pages) are classified once
+    clusters = ScreenshotClusters() if CLUSTER_SCREENSHOTS else None
+    batcher = ClassificationBatcher() if CLASSIFY_BATCH_SIZE > 1 else None
+    # Overnight runs: everything goes into Batch API jobs that are submitted once all sites are captured
+    batch_job = BatchJob(api_key=api_key, ledger=ledger) if BATCH_MODE else None
+    # Visual profile of every screenshot, for ranking and filtering the leads in the CSV
+    features = FeatureTable()
+    try:
+        # Sites arrive in the order their captures finish; slow sites may be retried at the end.
+        # Classifications run concurrently on the engine while later sites are still being captured.
+        for done, (index, capture) in enumerate(schedule_captures(jobs, pool=pool), start=1):
+            contact = sites[index - 1]
+            website, screenshot_file = contact["website"], paths[index]
+            logger.info(f"Processing website {done}/{len(jobs)}: {website}")
+            
+            if capture is None:
+                future = Future()
+                future.set_result(CAPTURE_FAILED_RESULT)
+            else:
+                if capture.get("image_b64"):
+                    features.add(website, capture["image_b64"])
+                future = submit_classification(capture["url"], screenshot_file=screenshot_file, pool=pool,
+                                               capture=capture, clusters=clusters, batcher=batcher,
+                                               batch_job=batch_job)
+            pending.append((contact, screenshot_file, capture, future))
+    finally:
+        if pool is not None:
+            pool.close()
+        if batcher is not None:
+            batcher.flush()
+    if batch_job is not None:
+        batch_job.run()
+    
+    start_time = time.time()
+    classified = [(contact, screenshot_file, capture, future.result())
+                  for contact, screenshot_file, capture, future in pending]
+    logger.info(f"Waited {time.time() - start_time:.2f} seconds for the last classifications")
+    
+    if TRIAGE_MODE and TRIAGE_EXPLAIN_LEADS and batch_job is None:
+        # Deferred stage: full explanations, only for the sites that became leads
+        explanations = {
+            i: submit_classification(capture["url"], screenshot_file=screenshot_file, capture=capture, triage=False)
+            for i, (contact, screenshot_file, capture, classification) in enumerate(classified)
+            if capture and verdict_of(classification) == "not good website"
+        }
+        logger.info(f"Fetching full explanations for {len(explanations)} leads")
+        for i, future in explanations.items():
+            contact, screenshot_file, capture, _ = classified[i]
+            classified[i] = (contact, screenshot_file, capture, future.result())
+    
+    for contact, screenshot_file, capture, classification in classified:
+        record_result(contact, screenshot_file, classification, capture, results, not_good_rows)
+    classification_cache.save()
     
     logger.info("Generating reports...")
     
@@ -300,8 +1038,20 @@ def main():
     html_file = f"ng_{timestamp}.html"
     
     if not_good_rows:
-        write_csv_report(not_good_rows, csv_file)
+        write_csv_report(not_good_rows, csv_file, features)
     generate_html_report(results, html_file)
+    if len(features):
+        features.save(f"ng_{timestamp}_features.npz")
+    if clusters is not None:
+        clusters.save_report(f"ng_{timestamp}_clusters.json")
+    wait_for_saves()
+    log_blocking_summary([capture for _, _, capture in results.values()])
+    log_preprocess_summary([capture.get("preprocess") for _, _, capture in results.values() if capture])
+    preclassifier.log_summary()
+    engine.log_hedge_stats()
+    ledger.log_summary()
+    ledger.save(f"ng_{timestamp}_usage.json")
+    log_text_first_summary([capture.get("text_first") for _, _, capture in results.values() if capture])
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,134 @@
+#driver_registry.py
+
+import os
+import json
+import time
+import shutil
+import logging
+import subprocess
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; resolution is then only locked in-process.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Where the resolved chromedriver is recorded so every process (and every later run) can reuse it.
+DRIVER_REGISTRY_PATH = os.getenv(
+    "DRIVER_REGISTRY_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "searchagent", "chromedriver.json"),
+)
+# Explicit driver binary, e.g. one baked into the image of an air-gapped worker.
+CHROMEDRIVER_PATH = os.getenv("CHROMEDRIVER_PATH")
+# When set, never contact the network to resolve a driver.
+DRIVER_OFFLINE = os.getenv("DRIVER_OFFLINE", "0") == "1"
+
+_resolved = None
+_resolve_lock = threading.Lock()
+
+def _driver_version(path):
+    try:
+        output = subprocess.run([path, "--version"], capture_output=True, text=True, timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    # e.g. "ChromeDriver 124.0.6367.91 (51df0e5e...)"
+    parts = output.split()
+    return parts[1] if len(parts) > 1 else None
+
+def _is_executable(path):
+    return bool(path) and os.path.isfile(path) and os.access(path, os.X_OK)
+
+def _read_registry():
+    try:
+        with open(DRIVER_REGISTRY_PATH, encoding="utf-8") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not _is_executable(entry.get("path")):
+        logger.warning(f"Registered chromedriver no longer exists: {entry.get('path')}")
+        return None
+    return entry
+
+def _write_registry(entry):
+    os.makedirs(os.path.dirname(DRIVER_REGISTRY_PATH), exist_ok=True)
+    tmp_path = f"{DRIVER_REGISTRY_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(entry, f, indent=2)
+    os.replace(tmp_path, DRIVER_REGISTRY_PATH)  # atomic, so readers never see a partial file
+
+def _resolve_uncached():
+    if CHROMEDRIVER_PATH:
+        if not _is_executable(CHROMEDRIVER_PATH):
+            raise RuntimeError(f"CHROMEDRIVER_PATH is not an executable file: {CHROMEDRIVER_PATH}")
+        return {"path": CHROMEDRIVER_PATH, "version": _driver_version(CHROMEDRIVER_PATH), "source": "env"}
+
+    entry = _read_registry()
+    if entry:
+        return entry
+
+    on_path = shutil.which("chromedriver")
+    if on_path:
+        entry = {"path": on_path, "version": _driver_version(on_path), "source": "PATH"}
+    elif DRIVER_OFFLINE:
+        raise RuntimeError(
+            "No chromedriver registered and DRIVER_OFFLINE=1. Set CHROMEDRIVER_PATH or run once "
+            f"with network access to populate {DRIVER_REGISTRY_PATH}."
+        )
+    else:
+        from webdriver_manager.chrome import ChromeDriverManager
+        logger.info("Resolving chromedriver with webdriver-manager")
+        path = ChromeDriverManager().install()
+        entry = {"path": path, "version": _driver_version(path), "source": "webdriver-manager"}
+
+    entry["resolved_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    _write_registry(entry)
+    logger.info(f"Registered chromedriver {entry['version']} at {entry['path']}")
+    return entry
+
+def resolve_chromedriver():
+    """
+    Returns the path to a chromedriver binary, resolving it at most once.
+
+    Resolution order: CHROMEDRIVER_PATH, the on-disk registry, chromedriver on PATH, and
+    finally webdriver-manager (skipped when DRIVER_OFFLINE=1). The result is persisted to
+    DRIVER_REGISTRY_PATH, and a file lock keeps parallel processes from downloading at once.
+
+    :return: Absolute path of the chromedriver executable.
+    """
+    global _resolved
+    with _resolve_lock:
+        if _resolved:
+            return _resolved["path"]
+
+        lock_file = None
+        if fcntl is not None:
+            os.makedirs(os.path.dirname(DRIVER_REGISTRY_PATH), exist_ok=True)
+            lock_file = open(f"{DRIVER_REGISTRY_PATH}.lock", "w")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            _resolved = _resolve_uncached()
+        finally:
+            if lock_file is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+        return _resolved["path"]
+
+def invalidate_chromedriver():
+    """
+    Forgets the registered driver, e.g. after Chrome auto-updated and the old driver
+    can no longer start a session. The next resolve_chromedriver() call resolves afresh.
+    """
+    global _resolved
+    with _resolve_lock:
+        _resolved = None
+        try:
+            os.remove(DRIVER_REGISTRY_PATH)
+            logger.info(f"Removed stale chromedriver registry {DRIVER_REGISTRY_PATH}")
+        except OSError:
+            pass
+
+if __name__ == "__main__":
+    # Populate the registry ahead of time, e.g. while building a worker image.
+    print(resolve_chromedriver())
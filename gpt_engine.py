@@ -0,0 +1,449 @@
+#gpt_engine.py
+
+import io
+import os
+import re
+import math
+import time
+import base64
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from openai import AsyncOpenAI, RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+
+logger = logging.getLogger(__name__)
+
+# Chat completions in flight at once.
+CLASSIFY_CONCURRENCY = int(os.getenv("CLASSIFY_CONCURRENCY", "8"))
+# Account limits for the model (see the organization's limits page); the defaults match usage tier 1 for gpt-4o.
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "30000"))
+# Attempts after the first for rate-limited, timed-out or failed requests.
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "6"))
+MAX_BACKOFF = 60
+# Hedging: a request still running after the HEDGE_PERCENTILE latency of recent requests gets a duplicate,
+# and the first answer wins. At most HEDGE_MAX_PER_RUN duplicates are sent (0 disables hedging).
+HEDGE_MAX_PER_RUN = int(os.getenv("HEDGE_MAX_PER_RUN", "20"))
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+# Completed requests needed before the threshold is trusted, the threshold's floor, and the sample window.
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 5.0
+LATENCY_WINDOW = 200
+# Duplicates in flight at once. They have their own slots so they never queue behind waiting requests.
+HEDGE_CONCURRENCY = 2
+
+# Image token accounting for gpt-4o vision inputs.
+LOW_DETAIL_TOKENS = 85
+TILE_TOKENS = 170
+# Used when an image's size cannot be read: a 1280x800 screenshot at high detail.
+DEFAULT_IMAGE_TOKENS = 1105
+
+def image_tokens(width, height, detail="auto"):
+    """
+    Tokens gpt-4o charges for an image: 85 at low detail, otherwise 85 plus 170 per
+    512px tile after fitting the image in 2048x2048 and scaling its short side to 768.
+    """
+    if detail == "low":
+        return LOW_DETAIL_TOKENS
+    scale = min(1, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return LOW_DETAIL_TOKENS + TILE_TOKENS * math.ceil(width / 512) * math.ceil(height / 512)
+
+def _data_url_tokens(image_url):
+    url = image_url.get("url", "")
+    detail = image_url.get("detail", "auto")
+    if detail == "low":
+        return LOW_DETAIL_TOKENS
+    try:
+        from PIL import Image
+        encoded = url.split(",", 1)[1]
+        # The image header is enough to read its size.
+        width, height = Image.open(io.BytesIO(base64.b64decode(encoded))).size
+        return image_tokens(width, height, detail)
+    except Exception:
+        return DEFAULT_IMAGE_TOKENS
+
+def estimate_tokens(messages, max_tokens=0):
+    """
+    Tokens a request counts against the TPM limit: text (about 4 characters per token),
+    images at their vision cost, plus max_tokens, which OpenAI reserves up front.
+    """
+    tokens = max_tokens or 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += len(content) // 4 + 4
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                tokens += len(part["text"]) // 4
+            elif part.get("type") == "image_url":
+                tokens += _data_url_tokens(part["image_url"])
+    return tokens
+
+def estimate_image_tokens(messages):
+    """The image part of estimate_tokens(messages)."""
+    return sum(_data_url_tokens(part["image_url"])
+               for message in messages if isinstance(message.get("content"), list)
+               for part in message["content"] if part.get("type") == "image_url")
+
+def parse_reset(value):
+    """Rate-limit reset durations such as "1s", "6m0s", "20ms" or "1h2m3.5s", in seconds."""
+    if not value:
+        return None
+    seconds = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        seconds += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return seconds
+
+def retry_delay(headers, attempt):
+    """Seconds to wait after a 429: the server's retry hint if it sent one, else exponential backoff."""
+    headers = headers or {}
+    if headers.get("retry-after-ms"):
+        return float(headers["retry-after-ms"]) / 1000
+    if headers.get("retry-after"):
+        try:
+            return float(headers["retry-after"])
+        except ValueError:
+            pass
+    reset = [parse_reset(headers.get("x-ratelimit-reset-requests")),
+             parse_reset(headers.get("x-ratelimit-reset-tokens"))]
+    reset = [r for r in reset if r is not None]
+    if reset:
+        return max(reset)
+    return min(MAX_BACKOFF, 2 ** attempt + random.random())
+
+class RateLimiter:
+    """
+    Token buckets for requests and tokens per minute.
+
+    Each request reserves its estimated tokens before it is sent; the estimate is
+    corrected from response.usage afterwards, and the buckets are clamped to the
+    x-ratelimit-remaining-* headers so other clients on the same key are accounted for.
+    """
+
+    def __init__(self, rpm=OPENAI_RPM, tpm=OPENAI_TPM):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+        return now
+
+    async def acquire(self, tokens):
+        """Waits until one request and tokens fit in both buckets, then takes them."""
+        # A request larger than the whole bucket still has to go through eventually.
+        tokens = min(tokens, self.tpm)
+        async with self._lock:
+            while True:
+                now = self._refill()
+                wait = self._paused_until - now
+                if wait <= 0:
+                    wait = max((1 - self._requests) * 60 / self.rpm, (tokens - self._tokens) * 60 / self.tpm)
+                    if wait <= 0:
+                        self._requests -= 1
+                        self._tokens -= tokens
+                        return
+                await asyncio.sleep(wait)
+
+    def settle(self, reserved, used):
+        """Returns the part of a reservation the request did not use."""
+        self._refill()
+        self._tokens = min(self.tpm, self._tokens + max(0, reserved - used))
+
+    def update(self, headers):
+        """Clamps the buckets to what the server says is left."""
+        self._refill()
+        try:
+            if headers.get("x-ratelimit-remaining-requests") is not None:
+                self._requests = min(self._requests, float(headers["x-ratelimit-remaining-requests"]))
+            if headers.get("x-ratelimit-remaining-tokens") is not None:
+                self._tokens = min(self._tokens, float(headers["x-ratelimit-remaining-tokens"]))
+        except ValueError:
+            pass
+
+    def pause(self, seconds):
+        """Holds every request back for seconds, e.g. after a 429."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+class ClassificationEngine:
+    """
+    Runs chat completions on the async OpenAI client from a background event loop.
+
+    Synchronous code hands work over with run() and gets a concurrent.futures.Future
+    back, so captures and API calls overlap. At most concurrency requests are in flight,
+    every request first waits for the RPM/TPM limiter, and 429s pause the limiter for as
+    long as the rate-limit headers ask before the request is retried. Requests slower than
+    the recent p95 latency are hedged with a duplicate (see _hedged).
+    """
+
+    def __init__(self, api_key=None, concurrency=CLASSIFY_CONCURRENCY, rpm=OPENAI_RPM, tpm=OPENAI_TPM,
+                 max_retries=OPENAI_MAX_RETRIES, max_hedges=HEDGE_MAX_PER_RUN, ledger=None):
+        # Retries are handled here, where they can respect the shared limiter.
+        self.client = AsyncOpenAI(api_key=api_key, max_retries=0)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.max_hedges = max_hedges
+        # Optional UsageLedger that gets one entry per request
+        self.ledger = ledger
+        self.limiter = RateLimiter(rpm, tpm)
+        # Latencies of requests that completed without a duplicate, for the hedging threshold
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.hedge_stats = {"requests": 0, "hedged": 0, "hedge_wins": 0, "seconds_saved": 0.0}
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._hedge_semaphore = asyncio.Semaphore(HEDGE_CONCURRENCY)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="gpt-engine", daemon=True)
+        self._thread.start()
+
+    async def create(self, stage="classify", **params):
+        """
+        Sends one chat completion (same parameters as client.chat.completions.create).
+
+        :param stage: Label of the call in the usage ledger.
+        :return: The parsed ChatCompletion.
+        :raises: The last error once retries are exhausted.
+        """
+        return await self._request(params, self._read_completion, stage)
+
+    async def create_until(self, stop, stage="triage", **params):
+        """
+        Streams one chat completion and stops reading as soon as stop(text so far) is
+        true. Closing the stream cancels the rest of the response.
+
+        :param stop: Callable taking the text received so far.
+        :param stage: Label of the call in the usage ledger.
+        :return: The text received.
+        :raises: The last error once retries are exhausted.
+        """
+        async def read(raw, estimated):
+            return await self._read_stream(raw, estimated, params.get("max_tokens") or 0, stop)
+        return await self._request({**params, "stream": True}, read, stage)
+
+    async def _read_completion(self, raw, estimated):
+        response = raw.parse()
+        if response.usage:
+            self.limiter.settle(estimated, response.usage.total_tokens)
+        return response
+
+    async def _read_stream(self, raw, estimated, max_tokens, stop):
+        stream = raw.parse()
+        text = ""
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    text += chunk.choices[0].delta.content
+                    if stop(text):
+                        break
+        finally:
+            await stream.close()
+        # Streams carry no usage; give back the completion tokens that were never generated.
+        self.limiter.settle(estimated, estimated - max_tokens + len(text) // 4)
+        return text
+
+    def hedge_threshold(self):
+        """Seconds after which a request gets a duplicate, or None while hedging is off or unproven."""
+        if not self.max_hedges or len(self._latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        latencies = sorted(self._latencies)
+        return max(HEDGE_MIN_DELAY, latencies[int(HEDGE_PERCENTILE / 100 * (len(latencies) - 1))])
+
+    async def _attempt(self, params, read, estimated):
+        try:
+            raw = await self.client.chat.completions.with_raw_response.create(**params)
+            self.limiter.update(raw.headers)
+            return await read(raw, estimated)
+        except asyncio.CancelledError:
+            # The losing side of a hedge: give back its reservation
+            self.limiter.settle(estimated, 0)
+            raise
+
+    async def _reserve_hedge(self, estimated):
+        """Takes a hedge slot and the duplicate's rate-limit reservation."""
+        await self._hedge_semaphore.acquire()
+        try:
+            await self.limiter.acquire(estimated)
+        except BaseException:
+            self._hedge_semaphore.release()
+            raise
+
+    async def _hedged(self, params, read, estimated, stage="classify", attempt=0):
+        """
+        One attempt at a request. If it is still running after hedge_threshold() and the
+        run's hedge budget is not spent, a duplicate is sent; whichever answers first wins
+        and the other is cancelled. The losing attempt gets its own ledger entry (the
+        caller records the winner, or the original request's error). Duplicates have their
+        own HEDGE_CONCURRENCY slots, so they skip the queue of waiting requests; if the
+        original answers while the duplicate still waits for a slot or the rate limiter,
+        no duplicate is sent.
+
+        :return: (result, whether a duplicate was sent).
+        """
+        start = time.monotonic()
+        self.hedge_stats["requests"] += 1
+        threshold = self.hedge_threshold()
+        primary = asyncio.ensure_future(self._attempt(params, read, estimated))
+        tasks = [primary]
+        # Hedge slot and rate-limit reservation for the duplicate, held here until the duplicate takes them over
+        reservation = None
+        try:
+            if threshold is not None:
+                await asyncio.wait({primary}, timeout=threshold)
+            if primary.done() or threshold is None or self.hedge_stats["hedged"] >= self.max_hedges:
+                result = await primary
+                self._latencies.append(time.monotonic() - start)
+                return result, False
+
+            reservation = asyncio.ensure_future(self._reserve_hedge(estimated))
+            await asyncio.wait({primary, reservation}, return_when=asyncio.FIRST_COMPLETED)
+            if primary.done() or self.hedge_stats["hedged"] >= self.max_hedges:
+                result = await primary
+                self._latencies.append(time.monotonic() - start)
+                return result, False
+
+            self.hedge_stats["hedged"] += 1
+            logger.info(f"OpenAI request running for {threshold:.1f}s, sending a duplicate")
+            hedge_start = time.monotonic()
+            hedge = asyncio.ensure_future(self._duplicate(params, read, estimated))
+            reservation = None
+            tasks.append(hedge)
+            started = {primary: start, hedge: hedge_start}
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in done if not task.cancelled() and task.exception() is None), None)
+                if winner is None:
+                    continue
+                elapsed = time.monotonic() - start
+                if winner is hedge:
+                    self.hedge_stats["hedge_wins"] += 1
+                    # The cancelled request would have taken about as long as the slow tail seen so far
+                    tail = [t for t in self._latencies if t > threshold]
+                    if tail:
+                        self.hedge_stats["seconds_saved"] += max(0.0, sum(tail) / len(tail) - elapsed)
+                else:
+                    self._latencies.append(elapsed)
+                loser = hedge if winner is primary else primary
+                self._record_attempt(stage, params, estimated, loser, started[loser], attempt)
+                return winner.result(), True
+            # Both failed; let the retry logic see the original request's error.
+            self._record_attempt(stage, params, estimated, hedge, hedge_start, attempt)
+            return primary.result(), True
+        finally:
+            if reservation is not None:
+                if reservation.done() and not reservation.cancelled() and reservation.exception() is None:
+                    self._hedge_semaphore.release()
+                    self.limiter.settle(estimated, 0)
+                reservation.cancel()
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def _duplicate(self, params, read, estimated):
+        """The hedge duplicate of a request; gives back the hedge slot taken for it when done."""
+        try:
+            return await self._attempt(params, read, estimated)
+        finally:
+            self._hedge_semaphore.release()
+
+    def log_hedge_stats(self):
+        stats = self.hedge_stats
+        if not stats["requests"]:
+            return
+        logger.info(f"Hedging: {stats['hedged']} of {stats['requests']} requests duplicated "
+                    f"({stats['hedged'] / stats['requests']:.1%}), the duplicate won {stats['hedge_wins']} times, "
+                    f"about {stats['seconds_saved']:.1f}s of latency saved")
+
+    def _record(self, stage, params, estimated, result, start, attempt_start, attempt, hedged=False, error=None,
+                cancelled=False):
+        if self.ledger is None:
+            return
+        usage = getattr(result, "usage", None)
+        max_tokens = params.get("max_tokens") or 0
+        if usage:
+            prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+        elif error:
+            prompt_tokens = completion_tokens = 0
+        else:
+            # Streamed and cancelled calls carry no usage: count what was sent and received
+            prompt_tokens = estimated - max_tokens
+            completion_tokens = len(result) // 4 if isinstance(result, str) else 0
+        self.ledger.record(stage, params.get("model"), prompt_tokens, completion_tokens,
+                           image_tokens=estimate_image_tokens(params["messages"]),
+                           seconds=time.monotonic() - attempt_start, waited=attempt_start - start,
+                           retries=attempt, hedged=hedged, estimated=not usage and not error, error=error,
+                           cancelled=cancelled)
+
+    def _record_attempt(self, stage, params, estimated, task, attempt_start, attempt):
+        """Ledger entry for the losing side of a hedge: cancelled (its prompt is still billed) or failed."""
+        if task.done() and not task.cancelled() and task.exception() is not None:
+            # Cancelled attempts settle themselves; a failed one is not seen by the retry logic
+            self.limiter.settle(estimated, 0)
+            self._record(stage, params, estimated, None, attempt_start, attempt_start, attempt, hedged=True,
+                         error=str(task.exception()))
+        else:
+            self._record(stage, params, estimated, None, attempt_start, attempt_start, attempt, hedged=True,
+                         cancelled=True)
+
+    async def _request(self, params, read, stage="classify"):
+        estimated = estimate_tokens(params["messages"], params.get("max_tokens"))
+        start = time.monotonic()
+        for attempt in range(self.max_retries + 1):
+            delay = 0
+            async with self._semaphore:
+                await self.limiter.acquire(estimated)
+                attempt_start = time.monotonic()
+                try:
+                    result, hedged = await self._hedged(params, read, estimated, stage, attempt)
+                    self._record(stage, params, estimated, result, start, attempt_start, attempt, hedged)
+                    return result
+                except RateLimitError as e:
+                    # A rejected request uses no tokens; the headers say how much budget is really left.
+                    self.limiter.settle(estimated, 0)
+                    self.limiter.update(e.response.headers)
+                    # An exhausted quota does not recover by waiting.
+                    if attempt == self.max_retries or getattr(e, "code", None) == "insufficient_quota":
+                        self._record(stage, params, estimated, None, start, attempt_start, attempt,
+                                     error=str(e))
+                        raise
+                    delay = retry_delay(e.response.headers, attempt)
+                    logger.warning(f"Rate limited by OpenAI, pausing requests for {delay:.1f}s")
+                    self.limiter.pause(delay)
+                    continue
+                except (APIConnectionError, APITimeoutError, InternalServerError) as e:
+                    if attempt == self.max_retries:
+                        self._record(stage, params, estimated, None, start, attempt_start, attempt,
+                                     error=str(e))
+                        raise
+                    self.limiter.settle(estimated, 0)
+                    delay = min(MAX_BACKOFF, 2 ** attempt + random.random())
+                    logger.warning(f"OpenAI request failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+                except Exception as e:
+                    # Not retryable (bad request, authentication, ...)
+                    self._record(stage, params, estimated, None, start, attempt_start, attempt, error=str(e))
+                    raise
+            # Back off outside the semaphore so other requests can use the slot meanwhile.
+            await asyncio.sleep(delay)
+
+    def run(self, coroutine):
+        """Schedules a coroutine on the engine's loop and returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def close(self):
+        """Closes the HTTP client and stops the event loop."""
+        self.run(self.client.close()).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
@@ -0,0 +1,328 @@
+#har_replay.py
+
+import os
+import re
+import ssl
+import json
+import time
+import base64
+import hashlib
+import logging
+import threading
+import subprocess
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+# Record mode: when set, every capture saves its traffic as a HAR archive in this directory.
+HAR_RECORD_DIR = os.getenv("HAR_RECORD_DIR")
+# Self-signed certificate the replay proxy presents for every HTTPS site (Chrome is told to accept it).
+HAR_CERT_DIR = os.getenv(
+    "HAR_CERT_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "searchagent", "har-replay"),
+)
+
+# Headers that describe the original transfer rather than the (decoded) archived body.
+_DROPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection", "keep-alive", "alt-svc"}
+
+def har_path(archive_dir, url):
+    """One archive per site, e.g. har/example_com_1a2b3c4d.har"""
+    host = urlsplit(url if "://" in url else f"http://{url}").netloc or url
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", host).strip("_")[:60] or "site"
+    return os.path.join(archive_dir, f"{slug}_{hashlib.sha1(url.encode()).hexdigest()[:8]}.har")
+
+def _har_headers(headers):
+    # DevTools joins repeated headers (e.g. Set-Cookie) with newlines.
+    return [{"name": name, "value": value}
+            for name, values in (headers or {}).items() for value in str(values).split("\n")]
+
+def _har_entry(request, response, body, base64_encoded, started):
+    timing = response.get("timing") or {}
+    wait = max(0, timing.get("receiveHeadersEnd", 0) - timing.get("sendStart", 0))
+    content = {"size": len(body), "mimeType": response.get("mimeType", ""), "text": body}
+    if base64_encoded:
+        content["encoding"] = "base64"
+    headers = response.get("headers") or {}
+    return {
+        "startedDateTime": datetime.fromtimestamp(started or time.time(), timezone.utc).isoformat(),
+        "time": round(wait),
+        "request": {
+            "method": request.get("method", "GET"),
+            "url": request["url"],
+            "httpVersion": "HTTP/1.1",
+            "headers": _har_headers(request.get("headers")),
+            "queryString": [],
+            "cookies": [],
+            "headersSize": -1,
+            "bodySize": -1,
+        },
+        "response": {
+            "status": response.get("status", 200),
+            "statusText": response.get("statusText", ""),
+            "httpVersion": "HTTP/1.1",
+            "headers": _har_headers(headers),
+            "cookies": [],
+            "content": content,
+            "redirectURL": headers.get("Location") or headers.get("location") or "",
+            "headersSize": -1,
+            "bodySize": -1,
+        },
+        "cache": {},
+        "timings": {"send": 0, "wait": round(wait), "receive": 0},
+    }
+
+def record_entries(driver, events):
+    """
+    Turns the DevTools network events of one navigation into HAR entries.
+
+    Response bodies are read back with Network.getResponseBody, so this must run before
+    the page navigates away. Redirect hops are recorded as their own entries.
+    """
+    exchanges = {}
+    entries = []
+    for event in events:
+        params = event.get("params", {})
+        request_id = params.get("requestId")
+        if event["method"] == "Network.requestWillBeSent":
+            previous = exchanges.get(request_id)
+            if previous and params.get("redirectResponse"):
+                entries.append(_har_entry(previous["request"], params["redirectResponse"], "", False,
+                                          previous["started"]))
+            exchanges[request_id] = {"request": params.get("request", {}), "started": params.get("wallTime")}
+        elif event["method"] == "Network.responseReceived" and request_id in exchanges:
+            exchanges[request_id]["response"] = params.get("response", {})
+        elif event["method"] == "Network.loadingFinished" and request_id in exchanges:
+            exchanges[request_id]["finished"] = True
+
+    for request_id, exchange in exchanges.items():
+        if not exchange.get("finished") or "response" not in exchange or \
+                exchange["request"].get("url", "").startswith("data:"):
+            continue
+        try:
+            body = driver.execute_cdp_cmd("Network.getResponseBody", {"requestId": request_id})
+        except Exception:
+            continue  # evicted from the DevTools buffer; replay will report it as a miss
+        entries.append(_har_entry(exchange["request"], exchange["response"], body["body"],
+                                  body.get("base64Encoded", False), exchange["started"]))
+    return entries
+
+def save_har(path, url, entries):
+    """Writes a HAR 1.2 archive whose single page is the captured url."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    har = {
+        "log": {
+            "version": "1.2",
+            "creator": {"name": "searchagent", "version": "1"},
+            "pages": [{"id": url, "title": url, "startedDateTime": entries[0]["startedDateTime"] if entries else "",
+                       "pageTimings": {}}],
+            "entries": [{**entry, "pageref": url} for entry in entries],
+        }
+    }
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(har, f)
+    os.replace(tmp_path, path)
+
+def _har_files(archive_dir):
+    return sorted(os.path.join(archive_dir, name) for name in os.listdir(archive_dir) if name.endswith(".har"))
+
+def archived_urls(archive_dir):
+    """The page URLs recorded in archive_dir, in file order."""
+    urls = []
+    for path in _har_files(archive_dir):
+        with open(path, encoding="utf-8") as f:
+            urls.extend(page["title"] for page in json.load(f)["log"]["pages"])
+    return urls
+
+def _without_query(url):
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, "", ""))
+
+def _is_mobile(headers):
+    return "Mobile" in next((h["value"] for h in headers if h["name"].lower() == "user-agent"), "")
+
+def _ensure_certificate(cert_dir=HAR_CERT_DIR):
+    cert_path = os.path.join(cert_dir, "cert.pem")
+    key_path = os.path.join(cert_dir, "key.pem")
+    if not (os.path.exists(cert_path) and os.path.exists(key_path)):
+        os.makedirs(cert_dir, exist_ok=True)
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "3650",
+                        "-subj", "/CN=searchagent-har-replay", "-keyout", key_path, "-out", cert_path],
+                       check=True, capture_output=True)
+    return cert_path, key_path
+
+class _ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    origin = ""
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def do_CONNECT(self):
+        # Terminate TLS ourselves and serve the tunnelled requests from the archive.
+        host, _, port = self.path.partition(":")
+        self.send_response(200, "Connection Established")
+        self.end_headers()
+        self.connection = self.server.ssl_context.wrap_socket(self.connection, server_side=True)
+        self.rfile = self.connection.makefile("rb")
+        self.wfile = self.connection.makefile("wb")
+        self.origin = f"https://{host}" if port in ("", "443") else f"https://{host}:{port}"
+        self.close_connection = False
+        while not self.close_connection:
+            self.handle_one_request()
+
+    def _replay(self):
+        url = self.path if "://" in self.path else self.origin + self.path
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        entry = self.server.proxy.lookup(self.command, url, "Mobile" in (self.headers.get("User-Agent") or ""))
+        if entry is None:
+            body = b"Not in archive"
+            self.send_response(404)
+            self.send_header("Content-Type", "text/plain")
+        else:
+            response = entry["response"]
+            content = response["content"]
+            text = content.get("text", "")
+            body = base64.b64decode(text) if content.get("encoding") == "base64" else text.encode("utf-8")
+            if self.server.proxy.latency:
+                time.sleep(entry.get("time", 0) / 1000)
+            self.send_response(response["status"], response.get("statusText") or None)
+            for header in response["headers"]:
+                if header["name"].lower() not in _DROPPED_HEADERS:
+                    self.send_header(header["name"], header["value"])
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    do_GET = do_POST = do_HEAD = do_PUT = do_DELETE = do_OPTIONS = do_PATCH = _replay
+
+class ReplayProxy:
+    """
+    Local HTTP(S) proxy that serves recorded HAR archives instead of the live web.
+
+    Requests are matched on method and URL, then on the URL without its query string
+    (to tolerate cache-busting parameters); desktop and mobile variants of a URL are told
+    apart by the user agent. Anything not in the archive gets a 404 and is counted as a miss.
+
+    Usable as a context manager::
+
+        with ReplayProxy("har") as proxy:
+            os.environ["HAR_REPLAY_PROXY"] = proxy.address
+    """
+
+    def __init__(self, archive_dir, port=0, latency=False):
+        """
+        :param archive_dir: Directory of .har files written in record mode.
+        :param port: Port to listen on (0 picks a free one).
+        :param latency: Delay each response by its recorded server wait time.
+        """
+        self.latency = latency
+        self.hits = 0
+        self.misses = []
+        self._lock = threading.Lock()
+        self._entries = {}
+        for path in _har_files(archive_dir):
+            with open(path, encoding="utf-8") as f:
+                for entry in json.load(f)["log"]["entries"]:
+                    request = entry["request"]
+                    for key in ((request["method"], request["url"]),
+                                (request["method"], _without_query(request["url"]))):
+                        self._entries.setdefault(key, []).append(entry)
+
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(*_ensure_certificate())
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _ReplayHandler)
+        self._server.daemon_threads = True
+        self._server.ssl_context = context
+        self._server.proxy = self
+        self._thread = None
+
+    @property
+    def address(self):
+        return f"127.0.0.1:{self._server.server_address[1]}"
+
+    def lookup(self, method, url, mobile=False):
+        candidates = self._entries.get((method, url)) or self._entries.get((method, _without_query(url)))
+        with self._lock:
+            if not candidates:
+                self.misses.append(url)
+                return None
+            self.hits += 1
+        return next((e for e in candidates if _is_mobile(e["request"]["headers"]) == mobile), candidates[0])
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="har-replay", daemon=True)
+        self._thread.start()
+        logger.info(f"Replaying {len(self._entries)} archived requests on {self.address}")
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0
+
+def benchmark(archive_dir, latency=False):
+    """
+    Re-captures every archived site through the replay proxy with the current capture
+    settings (pool size, workers, blocking, cache, budgets) and reports the timings.
+
+    :return: dict with sites, failed, timed_out, seconds, p50_ms, p95_ms, hits and misses.
+    """
+    with ReplayProxy(archive_dir, latency=latency) as proxy:
+        # Set before any browser launches; capture farm workers inherit it.
+        os.environ["HAR_REPLAY_PROXY"] = proxy.address
+        from browser_pool import BrowserPool
+        from capture_farm import CAPTURE_WORKERS
+        from capture_scheduler import schedule_captures
+
+        sites = [(i, url, None) for i, url in enumerate(archived_urls(archive_dir), start=1)]
+        pool = None if CAPTURE_WORKERS else BrowserPool()
+        start_time = time.time()
+        captures = []
+        try:
+            captures = [capture for _, capture in schedule_captures(sites, pool=pool)]
+        finally:
+            if pool is not None:
+                pool.close()
+        elapsed = [c["elapsed_ms"] for c in captures if c]
+        return {
+            "sites": len(sites),
+            "failed": sum(1 for c in captures if c is None),
+            "timed_out": sum(1 for c in captures if c and c["timed_out"]),
+            "seconds": round(time.time() - start_time, 2),
+            "p50_ms": _percentile(elapsed, 0.5),
+            "p95_ms": _percentile(elapsed, 0.95),
+            "hits": proxy.hits,
+            "misses": len(proxy.misses),
+        }
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 3 or sys.argv[1] not in ("serve", "bench"):
+        print("Usage: python3 har_replay.py serve <archive_dir> [port] | bench <archive_dir> [--latency]")
+        sys.exit(1)
+    if sys.argv[1] == "serve":
+        with ReplayProxy(sys.argv[2], port=int(sys.argv[3]) if len(sys.argv) > 3 else 8765) as proxy:
+            print(f"Set HAR_REPLAY_PROXY={proxy.address}; Ctrl+C to stop")
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                pass
+    else:
+        print(json.dumps(benchmark(sys.argv[2], latency="--latency" in sys.argv), indent=2))
@@ -0,0 +1,137 @@
+#image_preprocess.py
+
+import io
+import os
+import base64
+import logging
+from PIL import Image
+from gpt_engine import image_tokens
+from screenshot_capture import DESKTOP_WIDTH, DESKTOP_HEIGHT, MOBILE_WIDTH, MOBILE_HEIGHT
+
+logger = logging.getLogger(__name__)
+
+# Defaults leave screenshots as captured; pick settings from an A/B run (python3 image_preprocess.py ...).
+# Scale images wider than this down (0 keeps the width). 1024 keeps a desktop screenshot at 4 tiles instead of 6.
+IMAGE_MAX_WIDTH = int(os.getenv("IMAGE_MAX_WIDTH", "0"))
+# Re-encode as "jpeg" or "webp" ("" keeps the capture format).
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "")
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+# Crop anything below the first screenful (useful for full-page or clipped captures).
+IMAGE_CROP_FOLD = os.getenv("IMAGE_CROP_FOLD", "0") == "1"
+# Vision detail sent to GPT-4o: "low" (85 tokens, 512px), "high" or "auto".
+IMAGE_DETAIL = os.getenv("IMAGE_DETAIL", "high")
+
+PIL_FORMATS = {"png": "PNG", "jpeg": "JPEG", "webp": "WEBP"}
+MIME_FORMATS = {"image/png": "png", "image/jpeg": "jpeg", "image/webp": "webp"}
+
+def preprocess_image(image_b64, mime="image/png", max_width=IMAGE_MAX_WIDTH, image_format=IMAGE_FORMAT,
+                     quality=IMAGE_QUALITY, fold_ratio=None, detail=IMAGE_DETAIL):
+    """
+    Shrinks a screenshot before it is sent to GPT-4o.
+
+    :param image_b64: Base64 image as captured.
+    :param mime: Its MIME type.
+    :param max_width: Downscale wider images to this width (0 keeps the width).
+    :param image_format: "jpeg" or "webp" to re-encode, "" to keep the format.
+    :param quality: Compression quality for jpeg and webp.
+    :param fold_ratio: Height/width of one screenful; taller images are cropped to it.
+    :param detail: Vision detail level the image will be sent with.
+    :return: dict with image_b64, mime, detail, and bytes_before, bytes_after,
+             tokens_before (as captured, at auto detail) and tokens_after.
+    """
+    raw = base64.b64decode(image_b64)
+    image = Image.open(io.BytesIO(raw))
+    width, height = image.size
+    result = {
+        "image_b64": image_b64,
+        "mime": mime,
+        "detail": detail,
+        "bytes_before": len(raw),
+        "bytes_after": len(raw),
+        "tokens_before": image_tokens(width, height),
+    }
+
+    changed = False
+    if fold_ratio and height > width * fold_ratio:
+        image = image.crop((0, 0, width, round(width * fold_ratio)))
+        changed = True
+    if max_width and image.width > max_width:
+        image = image.resize((max_width, round(image.height * max_width / image.width)), Image.LANCZOS)
+        changed = True
+    target = image_format or MIME_FORMATS.get(mime, "png")
+    if changed or target != MIME_FORMATS.get(mime):
+        if target == "jpeg" and image.mode != "RGB":
+            image = image.convert("RGB")
+        buffer = io.BytesIO()
+        options = {"optimize": True} if target == "png" else {"quality": quality}
+        image.save(buffer, PIL_FORMATS[target], **options)
+        encoded = buffer.getvalue()
+        result.update(image_b64=base64.b64encode(encoded).decode("ascii"), mime=f"image/{target}",
+                      bytes_after=len(encoded))
+    result["tokens_after"] = image_tokens(image.width, image.height, detail)
+    return result
+
+def preprocess_screenshots(image_b64, mime, mobile_image_b64=None, crop_fold=IMAGE_CROP_FOLD):
+    """
+    Runs preprocess_image on a site's desktop and (optional) mobile screenshot with the
+    configured settings.
+
+    :return: (desktop result, mobile result or None, stats) where stats has the
+             bytes_saved and tokens_saved of the request.
+    """
+    desktop = preprocess_image(image_b64, mime, fold_ratio=DESKTOP_HEIGHT / DESKTOP_WIDTH if crop_fold else None)
+    mobile = None
+    if mobile_image_b64:
+        mobile = preprocess_image(mobile_image_b64, mime,
+                                  fold_ratio=MOBILE_HEIGHT / MOBILE_WIDTH if crop_fold else None)
+    results = [r for r in (desktop, mobile) if r]
+    stats = {
+        "bytes_saved": sum(r["bytes_before"] - r["bytes_after"] for r in results),
+        "tokens_saved": sum(r["tokens_before"] - r["tokens_after"] for r in results),
+    }
+    return desktop, mobile, stats
+
+def log_preprocess_summary(stats):
+    """Totals of the per-call preprocess stats recorded on each capture."""
+    stats = [s for s in stats if s]
+    if not stats:
+        return
+    bytes_saved = sum(s["bytes_saved"] for s in stats)
+    tokens_saved = sum(s["tokens_saved"] for s in stats)
+    logger.info(f"Image preprocessing: {bytes_saved / (1024 * 1024):.1f} MB and {tokens_saved} image tokens "
+                f"saved across {len(stats)} requests")
+
+if __name__ == "__main__":
+    # A/B run: classify saved screenshots as captured and as preprocessed with the current
+    # settings, and report verdict agreement, prompt tokens and latency for both.
+    import sys
+    import glob
+    import json
+    import mimetypes
+    if len(sys.argv) < 2:
+        print("Usage: python3 image_preprocess.py <screenshots_dir> [max_sites]")
+        sys.exit(1)
+    from classify_website import init_clients, build_messages, compare_requests
+    init_clients()
+    from screenshot_capture import mobile_screenshot_path
+    files = sorted(f for f in glob.glob(os.path.join(sys.argv[1], "screenshot_*")) if "_mobile." not in f)
+    files = files[:int(sys.argv[2])] if len(sys.argv) > 2 else files
+
+    def read_b64(path):
+        with open(path, "rb") as f:
+            return base64.b64encode(f.read()).decode("ascii")
+
+    pairs = []
+    for path in files:
+        mime = mimetypes.guess_type(path)[0] or "image/png"
+        image_b64 = read_b64(path)
+        mobile_path = mobile_screenshot_path(path)
+        mobile_b64 = read_b64(mobile_path) if os.path.exists(mobile_path) else None
+        desktop, mobile, _ = preprocess_screenshots(image_b64, mime, mobile_b64)
+        pairs.append((
+            path,
+            build_messages(image_b64, mime, mobile_b64),
+            build_messages(desktop["image_b64"], desktop["mime"], mobile and mobile["image_b64"],
+                           detail=desktop["detail"]),
+        ))
+    print(json.dumps(compare_requests(pairs), indent=2))
@@ -0,0 +1,113 @@
+#junk_detector.py
+
+import io
+import re
+import base64
+import logging
+from PIL import Image, ImageStat
+from preflight import PARKING_MARKERS
+
+logger = logging.getLogger(__name__)
+
+# A grayscale thumbnail with less spread than this is a blank page.
+BLANK_STDDEV = 4.0
+# Fewer distinct colors than this (after quantizing) means little more than a background.
+BLANK_COLORS = 3
+# A cookie/consent overlay covering more of the viewport than this hides the site.
+OVERLAY_COVERAGE = 0.5
+
+# Short forms parking pages use in their titles. Like the error titles below they must make up
+# the whole title or one end of it; "<domain> is for sale" counts only with a domain name as subject.
+TITLE_PARKING_MARKERS = ("domain for sale", "domain for sale!", "domain parked", "parked domain")
+DOMAIN_FOR_SALE = re.compile(r"(?:the domain (?:name )?)?[a-z0-9-]+(?:\.[a-z0-9-]+)+\s+(?:is|may be)\s+for sale[.!]?")
+# Titles of server error pages, bot challenges and default server pages. They must make up the
+# whole title or one end of it ("Page Not Found | Example"), never just appear somewhere in it.
+# Coming-soon and under-construction pages are left to the classifier: their owners are leads.
+ERROR_TITLE_MARKERS = (
+    "404 not found", "not found", "page not found", "403 forbidden", "access denied",
+    "500 internal server error", "502 bad gateway", "503 service unavailable", "service unavailable",
+    "bad request", "account suspended", "attention required! | cloudflare", "just a moment...",
+    "default web site page", "welcome to nginx!", "welcome to nginx", "apache2 ubuntu default page: it works",
+    "it works!", "this site can't be reached",
+)
+# Separators between the parts of a title, e.g. "Page Not Found | Example" or "Example - 404 Not Found".
+TITLE_SEPARATOR = re.compile(r"\s+[|\-\u2013\u2014:\u00b7]\s+|:\s+")
+# An error or parking title only counts when the page itself is sparse: few colors or little text.
+ERROR_PAGE_COLORS = 24
+ERROR_PAGE_WORDS = 150
+
+def image_stats(image_b64):
+    """
+    Cheap pixel statistics of a screenshot.
+
+    :return: dict with stddev (grayscale spread) and colors (distinct colors after
+             quantizing a thumbnail to 16 levels per channel).
+    """
+    image = Image.open(io.BytesIO(base64.b64decode(image_b64)))
+    thumbnail = image.convert("RGB").resize((64, 40))
+    stddev = ImageStat.Stat(thumbnail.convert("L")).stddev[0]
+    quantized = thumbnail.point(lambda value: value // 16 * 16)
+    colors = len(quantized.getcolors(64 * 40))
+    return {"stddev": stddev, "colors": colors}
+
+def _title_ends(title):
+    """The whole title and its first and last parts."""
+    parts = TITLE_SEPARATOR.split(title)
+    return (title, parts[0].strip(), parts[-1].strip())
+
+def error_title(title):
+    """True if a (lowercased) title is, or begins or ends with, an error page title."""
+    if title.startswith("index of /"):
+        return True
+    return any(candidate in ERROR_TITLE_MARKERS for candidate in _title_ends(title))
+
+def parking_title(title):
+    """True if a (lowercased) title is, or begins or ends with, a parking page title."""
+    return any(candidate in PARKING_MARKERS + TITLE_PARKING_MARKERS or DOMAIN_FOR_SALE.fullmatch(candidate)
+               for candidate in _title_ends(title))
+
+def detect_junk(capture):
+    """
+    Decides whether a capture is worth sending to GPT-4o.
+
+    Uses the final URL and page title recorded during capture, the cookie/consent
+    overlay coverage, and pixel statistics of the screenshot.
+
+    :param capture: A capture record from screenshot_capture.capture_screenshot.
+    :return: None for a usable capture, otherwise a dict with status (the label to
+             report instead of a verdict), reason, and retry (True if capturing again,
+             with overlays dismissed or more time to render, may fix it).
+    """
+    final_url = (capture.get("final_url") or "").lower()
+    title = (capture.get("title") or "").strip().lower()
+
+    if final_url.startswith("chrome-error://"):
+        return {"status": "error page", "reason": "Chrome could not load the site", "retry": False}
+
+    if capture.get("overlay_coverage", 0) > OVERLAY_COVERAGE:
+        return {
+            "status": "blocked by overlay",
+            "reason": f"Cookie/consent overlay covers {capture['overlay_coverage']:.0%} of the page",
+            "retry": not capture.get("overlays_dismissed"),
+        }
+
+    try:
+        stats = image_stats(capture["image_b64"])
+    except Exception as e:
+        logger.warning(f"Could not analyze screenshot of {capture.get('url')}: {str(e)}")
+        return None
+    words = (capture.get("page") or {}).get("word_count")
+    # A real page that happens to carry such a title has colors and text of its own.
+    sparse = stats["colors"] < ERROR_PAGE_COLORS or (words is not None and words < ERROR_PAGE_WORDS)
+    if sparse and parking_title(title):
+        return {"status": "parked domain", "reason": f"Parking page title: {capture.get('title')}", "retry": False}
+    if sparse and error_title(title):
+        return {"status": "error page", "reason": f"Error page title: {capture.get('title')}", "retry": False}
+    if stats["stddev"] < BLANK_STDDEV or stats["colors"] < BLANK_COLORS:
+        return {
+            "status": "blank website",
+            "reason": f"Screenshot is nearly uniform ({stats['colors']} colors, spread {stats['stddev']:.1f})",
+            # A page that was still rendering may fill in given more time.
+            "retry": not capture.get("settled"),
+        }
+    return None
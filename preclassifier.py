@@ -0,0 +1,286 @@
+#preclassifier.py
+
+import io
+import os
+import re
+import glob
+import json
+import base64
+import hashlib
+import logging
+import threading
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Trained model (python3 preclassifier.py train ng_*.html). Sites are only classified locally once it exists;
+# set to "" to disable.
+PRECLASSIFIER_MODEL = os.getenv(
+    "PRECLASSIFIER_MODEL",
+    os.path.join(os.path.expanduser("~"), ".cache", "searchagent", "preclassifier.json"),
+)
+# Agreement with GPT-4o the calibrated threshold must reach on the calibration split.
+PRECLASSIFIER_TARGET_AGREEMENT = float(os.getenv("PRECLASSIFIER_TARGET_AGREEMENT", "0.95"))
+MIN_TRAINING_SITES = 50
+FEATURE_VERSION = 1
+# Screenshots are reduced to this width before features are computed.
+THUMB_WIDTH = 160
+# Marks verdicts made locally, so they never become training labels.
+LOCAL_MARKER = "Classified locally by the pre-classifier"
+
+HUE_BINS = 12
+LEVEL_BINS = 4
+GRID = 4
+
+def image_features(image_b64):
+    """
+    Feature vector of a desktop screenshot, computed on its first screenful at THUMB_WIDTH.
+
+    Colour (hue, saturation and brightness histograms, distinct colours), contrast,
+    whitespace, edge density, the share of columns with content (narrow fixed-width
+    layouts are typical of dated sites) and a coarse grid of brightness and edges.
+    """
+    image = Image.open(io.BytesIO(base64.b64decode(image_b64))).convert("RGB")
+    width, height = image.size
+    image = image.crop((0, 0, width, min(height, round(width * 0.625))))
+    image = image.resize((THUMB_WIDTH, max(GRID, round(image.height * THUMB_WIDTH / width))), Image.BILINEAR)
+    rgb = np.asarray(image, dtype=np.float32) / 255
+    hsv = np.asarray(image.convert("HSV"), dtype=np.float32) / 255
+    gray = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    pixels = gray.size
+
+    hue, saturation, value = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    colourful = saturation * (value > 0.15)
+    hue_hist = np.histogram(hue, bins=HUE_BINS, range=(0, 1), weights=colourful)[0] / pixels
+    saturation_hist = np.histogram(saturation, bins=LEVEL_BINS, range=(0, 1))[0] / pixels
+    value_hist = np.histogram(value, bins=LEVEL_BINS, range=(0, 1))[0] / pixels
+
+    edges = (np.abs(np.diff(gray, axis=1))[:-1, :] + np.abs(np.diff(gray, axis=0))[:, :-1]) > 0.1
+    quantized = (rgb * 15).astype(np.int32)
+    colours = len(np.unique(quantized[..., 0] * 256 + quantized[..., 1] * 16 + quantized[..., 2]))
+    summary = [
+        np.mean((gray > 0.94) & (saturation < 0.08)),
+        np.mean(gray < 0.15),
+        np.log1p(colours) / np.log(4096),
+        gray.std(),
+        gray.mean(),
+        edges.mean(),
+        np.mean(gray.std(axis=0) > 0.02),
+    ]
+
+    rows = np.array_split(np.arange(edges.shape[0]), GRID)
+    columns = np.array_split(np.arange(edges.shape[1]), GRID)
+    grid = [gray[np.ix_(r, c)].mean() for r in rows for c in columns]
+    grid += [edges[np.ix_(r, c)].mean() for r in rows for c in columns]
+    return np.concatenate([hue_hist, saturation_hist, value_hist, summary, grid]).astype(np.float64)
+
+def report_label(classification):
+    """
+    1 for a "not good website" verdict, 0 for "good website", None for anything that is not
+    a GPT-4o verdict (junk and unreachable sites, failed calls, local verdicts).
+    """
+    lowered = classification.lower()
+    if LOCAL_MARKER.lower() in lowered or "analysis failed" in lowered or "unable to capture" in lowered:
+        return None
+    lines = lowered.strip().splitlines()
+    first = lines[0].strip() if lines else ""
+    if re.search(r"\bnot\s+(?:a\s+)?good website\b", first):
+        return 1
+    return 0 if "good website" in first else None
+
+REPORT_ENTRY = re.compile(
+    r"<h2>(.*?)</h2>\s*(?:<img src=\"data:[^;\"]+;base64,([^\"]+)\"[^>]*/>)?.*?"
+    r"<p><strong>Classification:</strong> (.*?)</p>",
+    re.S,
+)
+
+def load_report_labels(paths):
+    """
+    Screenshots and GPT-4o verdicts from HTML reports of past runs.
+
+    :return: {website: (image_b64, label)}; a site seen in several reports keeps its most
+             recent verdict.
+    """
+    examples = {}
+    for path in sorted(paths, key=os.path.getmtime):
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+        for website, image_b64, classification in REPORT_ENTRY.findall(html):
+            label = report_label(classification)
+            if image_b64 and label is not None:
+                examples[website] = (image_b64, label)
+    return examples
+
+def _sigmoid(z):
+    return 1 / (1 + np.exp(-np.clip(z, -30, 30)))
+
+def fit_logistic(X, y, l2=1.0, steps=2000, rate=0.5):
+    """L2-regularised logistic regression by full-batch gradient descent; returns (weights, bias)."""
+    weights, bias = np.zeros(X.shape[1]), 0.0
+    for _ in range(steps):
+        error = _sigmoid(X @ weights + bias) - y
+        weights -= rate * (X.T @ error + l2 * weights) / len(y)
+        bias -= rate * error.mean()
+    return weights, bias
+
+def split_of(website):
+    """Stable split by site: "train" (60%), "calibration" (20%) or "test" (20%)."""
+    bucket = int(hashlib.sha1(website.encode("utf-8")).hexdigest(), 16) % 10
+    return "train" if bucket < 6 else "calibration" if bucket < 8 else "test"
+
+def calibrate_threshold(confidence, agree, target=PRECLASSIFIER_TARGET_AGREEMENT):
+    """
+    Lowest confidence at which the predictions at or above it agree with GPT-4o at least
+    target of the time. Above 1 (nothing is classified locally) if no threshold does.
+    """
+    order = np.argsort(-confidence)
+    agreement = np.cumsum(agree[order]) / np.arange(1, len(order) + 1)
+    passing = np.nonzero(agreement >= target)[0]
+    return float(confidence[order][passing[-1]]) if len(passing) else 1.01
+
+def agreement_report(confidence, predicted, labels, threshold):
+    """How the model's confident verdicts compare with the GPT-4o labels."""
+    confident = confidence >= threshold
+    count = int(confident.sum())
+    return {
+        "sites": len(labels),
+        "classified_locally": count,
+        "coverage": round(count / len(labels), 3) if len(labels) else 0,
+        "agreement_on_local": round(float((predicted == labels)[confident].mean()), 3) if count else None,
+        "agreement_overall": round(float((predicted == labels).mean()), 3) if len(labels) else None,
+        "local_leads_gpt_good": int((confident & (predicted == 1) & (labels == 0)).sum()),
+        "local_good_gpt_leads": int((confident & (predicted == 0) & (labels == 1)).sum()),
+    }
+
+def train(paths, model_path=PRECLASSIFIER_MODEL, target=PRECLASSIFIER_TARGET_AGREEMENT):
+    """
+    Trains the pre-classifier on the labelled screenshots in the given HTML reports.
+
+    The logistic model is fitted on the train split, its probabilities are Platt-scaled and
+    the confidence threshold chosen on the calibration split, and the agreement report is
+    computed on the held-out test split. Everything is saved to model_path.
+
+    :return: The saved model dict.
+    """
+    examples = load_report_labels(paths)
+    if len(examples) < MIN_TRAINING_SITES:
+        raise ValueError(f"Need at least {MIN_TRAINING_SITES} labelled screenshots, found {len(examples)}")
+    rows = {"train": [], "calibration": [], "test": []}
+    for website, (image_b64, label) in examples.items():
+        try:
+            rows[split_of(website)].append((image_features(image_b64), label))
+        except Exception as e:
+            logger.warning(f"Skipping screenshot of {website}: {str(e)}")
+    data = {name: (np.array([r[0] for r in split]), np.array([r[1] for r in split], dtype=np.float64))
+            for name, split in rows.items() if split}
+    if len(data) < 3 or len(set(data["train"][1])) < 2:
+        raise ValueError("Not enough labelled screenshots of both verdicts in every split")
+
+    X, y = data["train"]
+    mean, scale = X.mean(axis=0), X.std(axis=0) + 1e-6
+    weights, bias = fit_logistic((X - mean) / scale, y)
+    model = {"version": FEATURE_VERSION, "mean": mean.tolist(), "scale": scale.tolist(),
+             "weights": weights.tolist(), "bias": bias, "platt": [1.0, 0.0]}
+
+    def logits(split):
+        return ((data[split][0] - mean) / scale) @ weights + bias
+
+    # Platt scaling: a one-feature logistic fit of the calibration labels on the raw logits
+    platt_weights, platt_bias = fit_logistic(logits("calibration")[:, None], data["calibration"][1], l2=0.0)
+    model["platt"] = [float(platt_weights[0]), float(platt_bias)]
+
+    def predict(split):
+        probability = _sigmoid(model["platt"][0] * logits(split) + model["platt"][1])
+        return np.maximum(probability, 1 - probability), (probability >= 0.5).astype(np.float64)
+
+    confidence, predicted = predict("calibration")
+    model["threshold"] = calibrate_threshold(confidence, predicted == data["calibration"][1], target)
+    confidence, predicted = predict("test")
+    model["report"] = {
+        "target_agreement": target,
+        "threshold": round(model["threshold"], 4),
+        "train_sites": len(data["train"][1]),
+        "calibration_sites": len(data["calibration"][1]),
+        "test": agreement_report(confidence, predicted, data["test"][1], model["threshold"]),
+    }
+    os.makedirs(os.path.dirname(model_path) or ".", exist_ok=True)
+    with open(model_path, "w", encoding="utf-8") as f:
+        json.dump(model, f)
+    return model
+
+class PreClassifier:
+    """
+    Decides the screenshots the trained model is confident about locally.
+
+    classify() returns a verdict when the calibrated confidence reaches the model's
+    threshold and None otherwise, in which case the site goes to GPT-4o as usual.
+    Without a trained model at path every site is left to GPT-4o.
+    """
+
+    def __init__(self, path=PRECLASSIFIER_MODEL):
+        self.model = None
+        self.local = 0
+        self.uncertain = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                model = json.load(f)
+            if model.get("version") == FEATURE_VERSION:
+                self.model = {k: np.array(v) if isinstance(v, list) else v for k, v in model.items()}
+                logger.info(f"Pre-classifier loaded from {path} (threshold {model['threshold']:.3f})")
+            else:
+                logger.warning(f"Ignoring pre-classifier {path}: trained on other features, retrain it")
+
+    def predict(self, image_b64):
+        """(1 for "not good website" or 0, calibrated confidence) for a screenshot."""
+        m = self.model
+        logit = ((image_features(image_b64) - m["mean"]) / m["scale"]) @ m["weights"] + m["bias"]
+        probability = float(_sigmoid(m["platt"][0] * logit + m["platt"][1]))
+        return int(probability >= 0.5), max(probability, 1 - probability)
+
+    def classify(self, website_url, image_b64):
+        """The local classification text for a confident screenshot, or None."""
+        if self.model is None or not image_b64:
+            return None
+        try:
+            label, confidence = self.predict(image_b64)
+        except Exception as e:
+            logger.warning(f"Pre-classifier failed for {website_url}: {str(e)}")
+            return None
+        with self._lock:
+            if confidence < self.model["threshold"]:
+                self.uncertain += 1
+                return None
+            self.local += 1
+        verdict = "not good website" if label else "good website"
+        logger.info(f"Pre-classified {website_url} as {verdict} (confidence {confidence:.3f})")
+        return f"{verdict}\n- {LOCAL_MARKER} (confidence {confidence:.2f})"
+
+    def log_summary(self):
+        if self.model is not None:
+            logger.info(f"Pre-classifier: {self.local} sites classified locally, "
+                        f"{self.uncertain} uncertain ones sent to GPT-4o")
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 3 or sys.argv[1] not in ("train", "evaluate"):
+        print("Usage: python3 preclassifier.py train|evaluate <report.html or glob> ...")
+        sys.exit(1)
+    paths = sorted({p for pattern in sys.argv[2:] for p in glob.glob(pattern)})
+    if sys.argv[1] == "train":
+        print(json.dumps(train(paths)["report"], indent=2))
+    else:
+        # Agreement of the saved model with the GPT-4o verdicts in other (e.g. newer) reports
+        classifier = PreClassifier()
+        if classifier.model is None:
+            print(f"No pre-classifier at {PRECLASSIFIER_MODEL}")
+            sys.exit(1)
+        predictions = [(*classifier.predict(image_b64), label)
+                       for image_b64, label in load_report_labels(paths).values()]
+        if not predictions:
+            print("No labelled screenshots found")
+            sys.exit(1)
+        predicted, confidence, labels = (np.array(column) for column in zip(*predictions))
+        print(json.dumps(agreement_report(confidence, predicted, labels, classifier.model["threshold"]), indent=2))
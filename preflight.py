@@ -0,0 +1,201 @@
+#preflight.py
+
+import os
+import ssl
+import json
+import time
+import socket
+import asyncio
+import logging
+from urllib.parse import urlsplit, urlunsplit
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Check every site before any browser is launched; set to 0 to capture Apollo URLs as-is.
+PREFLIGHT = os.getenv("PREFLIGHT", "1") == "1"
+PREFLIGHT_CONCURRENCY = int(os.getenv("PREFLIGHT_CONCURRENCY", "50"))
+PREFLIGHT_TIMEOUT = float(os.getenv("PREFLIGHT_TIMEOUT", "15"))
+# Results are reused across runs for this long.
+PREFLIGHT_CACHE_PATH = os.getenv(
+    "PREFLIGHT_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "searchagent", "preflight.json"),
+)
+PREFLIGHT_CACHE_TTL = int(os.getenv("PREFLIGHT_CACHE_TTL", str(24 * 3600)))
+# Timeouts, connection and TLS failures and 5xx/429 answers may clear up soon, so they are
+# only kept this long.
+PREFLIGHT_RETRY_TTL = int(os.getenv("PREFLIGHT_RETRY_TTL", "900"))
+
+# Bytes of the landing page read to look for domain-parking templates.
+BODY_SAMPLE_BYTES = 64 * 1024
+
+# Bot walls answer scripted requests with these codes but usually render fine in Chrome.
+BOT_WALL_STATUSES = {401, 403, 405, 429}
+
+PARKING_HOSTS = (
+    "sedoparking.com", "parkingcrew.net", "bodis.com", "above.com", "dan.com", "afternic.com",
+    "hugedomains.com", "undeveloped.com", "parklogic.com", "domainmarket.com", "sav.com",
+)
+PARKING_MARKERS = (
+    "this domain is for sale",
+    "this domain may be for sale",
+    "buy this domain",
+    "domain is parked",
+    "parked free, courtesy of godaddy",
+    "the domain name is for sale",
+    "this web page is parked",
+)
+
+HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+    ),
+    "Accept": "text/html,application/xhtml+xml;q=0.9,*/*;q=0.8",
+}
+
+def normalize_url(url):
+    """Adds a scheme to bare domains and drops fragments, e.g. 'Example.com/' -> 'https://example.com/'."""
+    url = url.strip()
+    if "://" not in url:
+        url = f"https://{url}"
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", parts.query, ""))
+
+def _result(url, status, reachable, final_url=None, http_status=None, detail=""):
+    return {
+        "url": url,
+        "final_url": final_url,
+        "status": status,
+        "http_status": http_status,
+        "reachable": reachable,
+        "detail": detail,
+        "checked_at": time.time(),
+    }
+
+async def _fetch(session, url):
+    async with session.get(url, allow_redirects=True, max_redirects=10) as response:
+        body = b""
+        if "html" in response.headers.get("Content-Type", ""):
+            body = await response.content.read(BODY_SAMPLE_BYTES)
+        return str(response.url), response.status, body.decode("utf-8", "ignore").lower()
+
+async def check_url(session, semaphore, url):
+    """
+    Resolves DNS, follows redirects and checks the landing page of one site.
+
+    :return: A result dict. status is one of ok, dns_error, tls_error, timeout,
+             connection_error, http_error or parked; reachable says whether it is worth
+             launching a browser, and final_url is the canonical URL to capture.
+    """
+    normalized = normalize_url(url)
+    host = urlsplit(normalized).hostname
+    if not host:
+        return _result(url, "dns_error", False, detail="no host name")
+    async with semaphore:
+        try:
+            await asyncio.get_running_loop().getaddrinfo(host, 443)
+        except (socket.gaierror, UnicodeError) as e:
+            return _result(url, "dns_error", False, detail=str(e))
+
+        # Try HTTPS first; fall back to plain HTTP for sites without a working certificate.
+        # If both fail, the HTTPS failure is reported.
+        candidates = [normalized]
+        if normalized.startswith("https://"):
+            candidates.append("http://" + normalized[len("https://"):])
+        failure = None
+        for candidate in candidates:
+            try:
+                final_url, http_status, body = await _fetch(session, candidate)
+            except asyncio.TimeoutError:
+                failure = failure or _result(url, "timeout", False, detail=f"no response within {PREFLIGHT_TIMEOUT:.0f}s")
+                continue
+            except (aiohttp.ClientSSLError, ssl.SSLError) as e:
+                failure = failure or _result(url, "tls_error", False, detail=str(e))
+                continue
+            except (aiohttp.ClientError, OSError) as e:
+                failure = failure or _result(url, "connection_error", False, detail=str(e))
+                continue
+
+            final_host = urlsplit(final_url).hostname or ""
+            if any(final_host == h or final_host.endswith("." + h) for h in PARKING_HOSTS) or \
+                    any(marker in body for marker in PARKING_MARKERS):
+                return _result(url, "parked", False, final_url, http_status, "domain parking page")
+            if http_status < 400 or http_status in BOT_WALL_STATUSES:
+                return _result(url, "ok", True, final_url, http_status)
+            return _result(url, "http_error", False, final_url, http_status, f"HTTP {http_status}")
+        return failure
+
+def _load_cache(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_cache(path, cache):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, path)
+
+async def _check_all(urls):
+    semaphore = asyncio.Semaphore(PREFLIGHT_CONCURRENCY)
+    timeout = aiohttp.ClientTimeout(total=PREFLIGHT_TIMEOUT)
+    connector = aiohttp.TCPConnector(limit=PREFLIGHT_CONCURRENCY, ttl_dns_cache=300)
+    async with aiohttp.ClientSession(headers=HEADERS, timeout=timeout, connector=connector) as session:
+        return await asyncio.gather(*(check_url(session, semaphore, url) for url in urls))
+
+def _transient(result):
+    """True for outcomes that may change on the next attempt."""
+    if result["status"] == "http_error":
+        return result["http_status"] is None or result["http_status"] >= 500 or result["http_status"] == 429
+    return result["status"] not in ("ok", "parked", "dns_error")
+
+def preflight_urls(urls, cache_path=PREFLIGHT_CACHE_PATH, ttl=PREFLIGHT_CACHE_TTL, retry_ttl=PREFLIGHT_RETRY_TTL):
+    """
+    Checks many sites concurrently before any browser is launched.
+
+    :param urls: Website URLs as they come from Apollo (bare domains are fine).
+    :param cache_path: JSON file where results are kept between runs.
+    :param ttl: Seconds a cached result stays valid.
+    :param retry_ttl: Seconds a cached transient failure (timeout, 5xx, ...) stays valid.
+    :return: Dict mapping each input URL to its check_url() result.
+    """
+    cache = _load_cache(cache_path)
+    now = time.time()
+    results = {}
+    to_check = []
+
+    def fresh(result):
+        return now - result["checked_at"] < (retry_ttl if _transient(result) else ttl)
+
+    for url in dict.fromkeys(urls):
+        cached = cache.get(url)
+        if cached and fresh(cached):
+            results[url] = cached
+        else:
+            to_check.append(url)
+
+    cached_count = len(results)
+    if to_check:
+        start_time = time.time()
+        for result in asyncio.run(_check_all(to_check)):
+            results[result["url"]] = result
+            cache[result["url"]] = result
+        logger.info(f"Pre-flight checked {len(to_check)} sites in {time.time() - start_time:.2f} seconds "
+                    f"({cached_count} from cache)")
+        # Drop expired entries so the cache file does not grow without bound.
+        _save_cache(cache_path, {u: r for u, r in cache.items() if fresh(r)})
+
+    unreachable = [r for r in results.values() if not r["reachable"]]
+    if unreachable:
+        logger.info(f"Pre-flight: {len(unreachable)} of {len(results)} sites unreachable")
+    return results
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    for url, result in preflight_urls(sys.argv[1:]).items():
+        print(url, result["status"], result["final_url"] or result["detail"])
@@ -1,40 +1,593 @@
 #screenshot_capture.py
 
+import os
+import json
 import time
+import base64
+import logging
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
+from selenium.common.exceptions import SessionNotCreatedException, TimeoutException
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
+from driver_registry import resolve_chromedriver, invalidate_chromedriver, DRIVER_OFFLINE, CHROMEDRIVER_PATH
+from browser_cache import acquire_cache_shard, release_cache_shard, BROWSER_CACHE_DIR, BROWSER_CACHE_SHARD_MB
+from har_replay import record_entries, save_har, har_path, HAR_RECORD_DIR
 
-def capture_screenshot(url, output_path="screenshot.png"):
+logger = logging.getLogger(__name__)
+
+# Upper bound on any single navigation so a stuck site cannot pin a browser forever.
+PAGE_LOAD_TIMEOUT = 60
+
+# Seconds one site may spend on navigation, readiness and screenshots before a best-effort capture.
+SITE_TIME_BUDGET = float(os.getenv("SITE_TIME_BUDGET", "30"))
+# When driver.get returns: "normal" (load event), "eager" (DOMContentLoaded) or "none".
+# Readiness is then awaited within the site's budget, so slow trackers cannot hold up the capture.
+PAGE_LOAD_STRATEGY = os.getenv("PAGE_LOAD_STRATEGY", "eager")
+# Part of the budget kept back for the screenshot itself, and the least worth spending on a mobile reload.
+SCREENSHOT_RESERVE = 2
+MIN_MOBILE_BUDGET = 3
+# Longest wait for the load event once the body is there (late images, slow trackers).
+LOAD_EVENT_WAIT = 5
+
+# Viewports: the desktop window, and the phone emulated for the mobile screenshot.
+DESKTOP_WIDTH, DESKTOP_HEIGHT = 1280, 800
+MOBILE_WIDTH, MOBILE_HEIGHT = 390, 844
+DESKTOP_SIZE = f"{DESKTOP_WIDTH}x{DESKTOP_HEIGHT}"
+MOBILE_SIZE = f"{MOBILE_WIDTH}x{MOBILE_HEIGHT}"
+MOBILE_USER_AGENT = (
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 "
+    "(KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1"
+)
+# Also take a mobile-emulated screenshot in the same browser session.
+CAPTURE_MOBILE = os.getenv("CAPTURE_MOBILE", "1") == "1"
+
+# Encoding of the screenshot returned by DevTools: png, jpeg or webp (quality applies to the latter two).
+CAPTURE_FORMAT = os.getenv("CAPTURE_FORMAT", "png")
+CAPTURE_QUALITY = int(os.getenv("CAPTURE_QUALITY", "80"))
+IMAGE_EXTENSIONS = {"png": ".png", "jpeg": ".jpg", "webp": ".webp"}
+IMAGE_MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+# Opt-in blocking of analytics, ad, chat-widget and tag-manager requests during capture.
+BLOCK_THIRD_PARTY = os.getenv("BLOCK_THIRD_PARTY", "0") == "1"
+# Optional file with one URL pattern per line ('*' wildcards, '#' comments) replacing DEFAULT_BLOCKLIST.
+BLOCKLIST_FILE = os.getenv("BLOCKLIST_FILE")
+# Reload every Nth blocked capture without blocking to measure the load time actually saved.
+BLOCKING_SAMPLE_EVERY = int(os.getenv("BLOCKING_SAMPLE_EVERY", "10"))
+
+# Hosts whose requests do not change how a page looks in a screenshot.
+DEFAULT_BLOCKLIST = [
+    # Analytics and tag managers
+    "*google-analytics.com/*",
+    "*googletagmanager.com/*",
+    "*analytics.google.com/*",
+    "*static.hotjar.com/*",
+    "*script.hotjar.com/*",
+    "*clarity.ms/*",
+    "*cdn.segment.com/*",
+    "*api.segment.io/*",
+    "*cdn.mxpnl.com/*",
+    "*api-js.mixpanel.com/*",
+    "*fullstory.com/s/fs.js*",
+    "*script.crazyegg.com/*",
+    "*js.hs-scripts.com/*",
+    "*js.hs-analytics.net/*",
+    "*js.hsadspixel.net/*",
+    "*bam.nr-data.net/*",
+    "*js-agent.newrelic.com/*",
+    "*scorecardresearch.com/*",
+    "*quantserve.com/*",
+    # Ads and retargeting pixels
+    "*doubleclick.net/*",
+    "*googlesyndication.com/*",
+    "*googleadservices.com/*",
+    "*adservice.google.com/*",
+    "*connect.facebook.net/*",
+    "*facebook.com/tr*",
+    "*bat.bing.com/*",
+    "*snap.licdn.com/*",
+    "*px.ads.linkedin.com/*",
+    "*analytics.tiktok.com/*",
+    "*ads-twitter.com/*",
+    "*amazon-adsystem.com/*",
+    "*criteo.com/*",
+    "*criteo.net/*",
+    "*taboola.com/*",
+    "*outbrain.com/*",
+    # Chat widgets
+    "*widget.intercom.io/*",
+    "*js.intercomcdn.com/*",
+    "*js.driftt.com/*",
+    "*embed.tawk.to/*",
+    "*static.zdassets.com/*",
+    "*cdn.livechatinc.com/*",
+    "*code.tidio.co/*",
+    "*client.crisp.chat/*",
+    "*static.olark.com/*",
+]
+
+# Cookie/consent overlays: how much of the viewport the largest one covers (0-1).
+OVERLAY_COVERAGE_JS = """
+const keywords = /cookie|consent|gdpr|privacy/i;
+let coverage = 0;
+for (const el of document.querySelectorAll('body *')) {
+    const style = getComputedStyle(el);
+    if ((style.position !== 'fixed' && style.position !== 'sticky') || style.display === 'none' ||
+            style.visibility === 'hidden' || parseFloat(style.opacity) === 0) continue;
+    const r = el.getBoundingClientRect();
+    const area = Math.max(0, Math.min(r.right, innerWidth) - Math.max(r.left, 0)) *
+                 Math.max(0, Math.min(r.bottom, innerHeight) - Math.max(r.top, 0));
+    if (area && keywords.test(el.innerText || '')) coverage = Math.max(coverage, area / (innerWidth * innerHeight));
+}
+return coverage;
+"""
+# Clicks the accept button of cookie/consent overlays, or removes overlays that have none.
+DISMISS_OVERLAYS_JS = """
+const keywords = /cookie|consent|gdpr|privacy/i;
+const accept = /^(accept|accept all|accept cookies|allow all|allow cookies|agree|i agree|got it|ok|okay|continue)$/i;
+let dismissed = 0;
+for (const el of document.querySelectorAll('body *')) {
+    const position = getComputedStyle(el).position;
+    if ((position !== 'fixed' && position !== 'sticky') || !el.isConnected || !keywords.test(el.innerText || '')) continue;
+    const button = [...el.querySelectorAll('button, a, [role=button], input[type=button], input[type=submit]')]
+        .find(b => accept.test((b.innerText || b.value || '').trim()));
+    if (button) button.click(); else el.remove();
+    dismissed++;
+}
+document.documentElement.style.overflow = document.body.style.overflow = '';
+return dismissed;
+"""
+# Load timing, metadata, accessibility and text signals, read in the capture session so no stage reloads the page.
+PAGE_SIGNALS_JS = """
+const maxText = arguments[0];
+const maxOutline = arguments[1];
+const ms = value => value > 0 ? Math.round(value) : null;
+const nav = performance.getEntriesByType('navigation')[0] || {};
+const paint = performance.getEntriesByName('first-contentful-paint')[0];
+let lcp = null;
+try {
+    // Buffered entries are available synchronously through takeRecords().
+    const observer = new PerformanceObserver(() => {});
+    observer.observe({type: 'largest-contentful-paint', buffered: true});
+    const entries = observer.takeRecords();
+    observer.disconnect();
+    if (entries.length) lcp = entries[entries.length - 1].startTime;
+} catch (e) {}
+const meta = name => (document.querySelector(`meta[name="${name}" i]`) || {}).content || null;
+const images = [...document.images].filter(img => img.width > 1 && img.height > 1);
+const text = (document.body ? document.body.innerText : '').replace(/\\s+/g, ' ').trim();
+// Headings, navigation, calls to action and forms in page order, with their offset from the top.
+const label = el => (el.innerText || el.value || el.getAttribute('aria-label') || '').replace(/\\s+/g, ' ').trim();
+const outline = [];
+for (const el of document.querySelectorAll(
+        'h1, h2, h3, nav a, header a, button, [role=button], input[type=submit], form, footer')) {
+    const rect = el.getBoundingClientRect();
+    if (rect.width < 1 || rect.height < 1) continue;
+    const tag = el.closest('nav, header') && el.tagName === 'A' ? 'nav' : el.tagName.toLowerCase();
+    const detail = tag === 'form' ? `${el.elements.length} fields` : label(el).slice(0, 80);
+    if (tag !== 'form' && tag !== 'footer' && !detail) continue;
+    outline.push({tag: tag, text: tag === 'footer' ? detail.slice(0, 120) : detail,
+                  top: Math.round(rect.top + window.scrollY)});
+    if (outline.length >= maxOutline) break;
+}
+return {
+    ttfb_ms: ms(nav.responseStart),
+    fcp_ms: ms(paint && paint.startTime),
+    lcp_ms: ms(lcp),
+    dom_content_loaded_ms: ms(nav.domContentLoadedEventEnd),
+    load_event_ms: ms(nav.loadEventEnd),
+    meta_description: meta('description'),
+    viewport_meta: meta('viewport') !== null,
+    lang: document.documentElement.lang || null,
+    h1_count: document.querySelectorAll('h1').length,
+    links: document.links.length,
+    buttons: document.querySelectorAll('button, [role=button], input[type=submit]').length,
+    forms: document.forms.length,
+    images: images.length,
+    images_with_alt: images.filter(img => (img.getAttribute('alt') || '').trim()).length,
+    word_count: text ? text.split(' ').length : 0,
+    text: text.slice(0, maxText),
+    outline: outline,
+};
+"""
+# Characters of visible page text kept in the capture record.
+PAGE_TEXT_CHARS = int(os.getenv("PAGE_TEXT_CHARS", "4000"))
+# Headings, links, buttons and forms kept in the page outline.
+OUTLINE_ITEMS = 60
+
+# Pause after dismissing overlays so their close animations finish before the screenshot.
+DISMISS_SETTLE = 0.5
+
+# Screenshots are written to disk off the hot path.
+_save_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="screenshot-save")
+_pending_saves = []
+
+# Measured savings per blocked request from sampled captures, used to estimate the rest.
+_sampled_savings_per_request = []
+_blocked_captures = 0
+
+def load_blocklist(path=BLOCKLIST_FILE):
     """
-    Launches a headless Chrome browser to navigate to the given URL and takes a screenshot.
-    
-    :param url: The URL of the website to capture.
-    :param output_path: The filename where the screenshot will be saved.
+    Returns the URL patterns to block.
+
+    :param path: Optional file with one pattern per line. Without it DEFAULT_BLOCKLIST is used.
+    """
+    if not path:
+        return list(DEFAULT_BLOCKLIST)
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+def create_driver():
+    """
+    Launches a headless Chrome browser configured for website captures.
+
+    The browser keeps cookies and storage in its own throwaway profile but reads and
+    writes its HTTP cache in a persistent shard under BROWSER_CACHE_DIR, so fonts and
+    CDN bundles downloaded for one site are reused by later sites and runs.
+
+    :return: A ready-to-use Selenium Chrome driver. The caller owns it and must release it
+             with close_driver().
     """
     options = webdriver.ChromeOptions()
     options.add_argument("--headless")  # Run in headless mode.
-    options.add_argument("--window-size=1280,800")  # Set a fixed window size.
-    
-    # Initialize the Chrome driver.
-    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
-    
+    options.add_argument(f"--window-size={DESKTOP_WIDTH},{DESKTOP_HEIGHT}")  # Set a fixed window size.
+    # DevTools network events, used to count blocked requests.
+    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    options.page_load_strategy = PAGE_LOAD_STRATEGY
+    # Replay mode: serve recorded archives from a local proxy instead of the live web (see har_replay.py).
+    # Read at launch so a benchmark can start its proxy first.
+    replay_proxy = os.getenv("HAR_REPLAY_PROXY")
+    if replay_proxy:
+        options.add_argument(f"--proxy-server={replay_proxy}")
+        options.add_argument("--proxy-bypass-list=<-loopback>")
+        options.add_argument("--ignore-certificate-errors")
+
+    shard_lock = None
+    if BROWSER_CACHE_DIR:
+        cache_dir, shard_lock = acquire_cache_shard()
+        options.add_argument(f"--disk-cache-dir={cache_dir}")
+        options.add_argument(f"--disk-cache-size={BROWSER_CACHE_SHARD_MB * 1024 * 1024}")
+
+    # Initialize the Chrome driver from the registered binary (no per-call version check).
+    try:
+        try:
+            driver = webdriver.Chrome(service=Service(resolve_chromedriver()), options=options)
+        except SessionNotCreatedException:
+            if DRIVER_OFFLINE or CHROMEDRIVER_PATH:
+                raise
+            # Chrome was probably updated past the registered driver; resolve a matching one once.
+            invalidate_chromedriver()
+            driver = webdriver.Chrome(service=Service(resolve_chromedriver()), options=options)
+    except Exception:
+        release_cache_shard(shard_lock)
+        raise
+    driver.cache_shard_lock = shard_lock
+    driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+    return driver
+
+def close_driver(driver):
+    """Quits a driver from create_driver() and frees its cache shard for the next browser."""
+    try:
+        driver.quit()
+    finally:
+        release_cache_shard(getattr(driver, "cache_shard_lock", None))
+
+def _save_async(output_path, image_b64):
+    def save():
+        directory = os.path.dirname(output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(output_path, "wb") as f:
+            f.write(base64.b64decode(image_b64))
+    _pending_saves.append(_save_executor.submit(save))
+
+def wait_for_saves():
+    """Blocks until every queued screenshot write has finished, logging any that failed."""
+    while _pending_saves:
+        future = _pending_saves.pop()
+        try:
+            future.result()
+        except Exception as e:
+            logger.error(f"Failed to save screenshot: {str(e)}")
+
+def take_screenshot(driver, image_format=CAPTURE_FORMAT, quality=CAPTURE_QUALITY, clip=None):
+    """
+    Captures the current viewport through DevTools without touching the disk.
+
+    :param image_format: "png", "jpeg" or "webp".
+    :param quality: Compression quality (0-100) for jpeg and webp.
+    :param clip: Optional region dict with x, y, width and height in CSS pixels.
+    :return: The encoded image as a base64 string, ready for a data URL.
+    """
+    params = {"format": image_format}
+    if image_format != "png":
+        params["quality"] = quality
+    if clip:
+        params["clip"] = {"scale": 1, **clip}
+    return driver.execute_cdp_cmd("Page.captureScreenshot", params)["data"]
+
+def _network_events(driver):
+    """Drains the driver's buffered DevTools network events."""
     try:
+        entries = driver.get_log("performance")
+    except Exception:
+        return []
+    events = []
+    for entry in entries:
+        try:
+            message = json.loads(entry["message"])["message"]
+        except (KeyError, ValueError):
+            continue
+        if message.get("method", "").startswith("Network."):
+            events.append(message)
+    return events
+
+def _blocked_requests(events):
+    """URLs of requests that DevTools blocked during the last navigation."""
+    urls = {}
+    blocked = []
+    for event in events:
+        params = event.get("params", {})
+        if event["method"] == "Network.requestWillBeSent":
+            urls[params.get("requestId")] = params.get("request", {}).get("url", "")
+        elif event["method"] == "Network.loadingFailed" and params.get("blockedReason"):
+            blocked.append(urls.get(params.get("requestId"), ""))
+    return blocked
+
+def _network_totals(events):
+    """Requests made and bytes transferred during the last navigation."""
+    requests = 0
+    transfer_bytes = 0
+    for event in events:
+        params = event.get("params", {})
+        if event["method"] == "Network.requestWillBeSent" and \
+                not params.get("request", {}).get("url", "").startswith("data:"):
+            requests += 1
+        elif event["method"] == "Network.loadingFinished":
+            transfer_bytes += int(params.get("encodedDataLength") or 0)
+    return {"requests": requests, "transfer_bytes": transfer_bytes}
+
+def _remaining(deadline):
+    return max(0.0, deadline - time.time())
+
+def _navigate(driver, url, deadline):
+    """
+    Loads url and waits for it to be ready, without going past the deadline.
+
+    If the budget runs out the load is stopped, so whatever has rendered so far can
+    still be captured. Once the body is there the load event gets at most LOAD_EVENT_WAIT
+    seconds; a page that never fires it is captured as it is, and is not timed out.
+
+    :return: (wall time in milliseconds, True if the budget ran out before the body rendered)
+    """
+    start_time = time.time()
+    timed_out = False
+    try:
+        driver.set_page_load_timeout(max(1, _remaining(deadline) - SCREENSHOT_RESERVE))
         driver.get(url)
+    except TimeoutException:
+        timed_out = True
+        driver.execute_script("window.stop();")
+    finally:
+        driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+
+    try:
         # Wait for body to be present instead of arbitrary sleep
-        WebDriverWait(driver, 10).until(
+        WebDriverWait(driver, max(0.5, min(10, _remaining(deadline) - SCREENSHOT_RESERVE))).until(
             EC.presence_of_element_located((By.TAG_NAME, "body"))
         )
-        driver.save_screenshot(output_path)
+    except TimeoutException:
+        timed_out = True
+        driver.execute_script("window.stop();")
+    if not timed_out:
+        # With the eager/none strategies get() returns early; give late images a few seconds.
+        try:
+            WebDriverWait(driver, max(0.5, min(LOAD_EVENT_WAIT, _remaining(deadline) - SCREENSHOT_RESERVE))).until(
+                lambda d: d.execute_script("return document.readyState") == "complete"
+            )
+        except TimeoutException:
+            logger.debug(f"No load event for {url} after {LOAD_EVENT_WAIT}s, capturing the rendered page")
+            driver.execute_script("window.stop();")
+    return (time.time() - start_time) * 1000, timed_out
+
+def mobile_screenshot_path(output_path):
+    """screenshot_3_example_com.png -> screenshot_3_example_com_mobile.png"""
+    root, extension = os.path.splitext(output_path)
+    return f"{root}_mobile{extension}"
+
+def _capture_mobile(driver, url, image_format, quality, deadline):
+    """
+    Re-renders the page on an emulated phone in the same session and screenshots it.
+
+    The reload reuses the browser's open connections and HTTP cache, so it costs far
+    less than a second capture. The emulation is always undone for the next capture.
+    """
+    desktop_user_agent = driver.execute_script("return navigator.userAgent")
+    # Scale factor 1 keeps the image (and its GPT-4o token cost) at 390x844.
+    driver.execute_cdp_cmd("Emulation.setDeviceMetricsOverride", {
+        "width": MOBILE_WIDTH,
+        "height": MOBILE_HEIGHT,
+        "deviceScaleFactor": 1,
+        "mobile": True,
+    })
+    driver.execute_cdp_cmd("Emulation.setTouchEmulationEnabled", {"enabled": True, "maxTouchPoints": 5})
+    driver.execute_cdp_cmd("Network.setUserAgentOverride", {"userAgent": MOBILE_USER_AGENT})
+    try:
+        # Reload so sites that pick their layout from the user agent serve the mobile one.
+        _navigate(driver, url, deadline)
+        return take_screenshot(driver, image_format, quality)
     finally:
-        driver.quit()
+        driver.execute_cdp_cmd("Network.setUserAgentOverride", {"userAgent": desktop_user_agent})
+        driver.execute_cdp_cmd("Emulation.setTouchEmulationEnabled", {"enabled": False})
+        driver.execute_cdp_cmd("Emulation.clearDeviceMetricsOverride", {})
+
+def _blocking_stats(driver, url, blocked, load_ms, timed_out, time_budget):
+    """Per-site blocking report: requests blocked, hosts, and the load time saved (measured or estimated)."""
+    global _blocked_captures
+    stats = {
+        "blocked_requests": len(blocked),
+        "blocked_hosts": sorted({urlsplit(u).netloc for u in blocked if u}),
+        "saved_ms": None,
+        "saved_measured": False,
+    }
+
+    _blocked_captures += 1
+    if (blocked and not timed_out and BLOCKING_SAMPLE_EVERY
+            and (_blocked_captures - 1) % BLOCKING_SAMPLE_EVERY == 0):
+        # Reload unblocked to measure the difference. The blocked load ran first, so the
+        # first-party assets are already cached for this reload and the saving is understated.
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": []})
+        # The measurement reload gets its own budget; it is not part of the capture.
+        unblocked_ms, _ = _navigate(driver, url, time.time() + time_budget)
+        stats["saved_ms"] = round(unblocked_ms - load_ms)
+        stats["saved_measured"] = True
+        _sampled_savings_per_request.append((unblocked_ms - load_ms) / len(blocked))
+    elif blocked and _sampled_savings_per_request:
+        per_request = sum(_sampled_savings_per_request) / len(_sampled_savings_per_request)
+        stats["saved_ms"] = round(per_request * len(blocked))
+
+    logger.info(f"Blocked {len(blocked)} third-party requests on {url} "
+                f"(load {round(load_ms)} ms, saved "
+                f"{stats['saved_ms'] if stats['saved_ms'] is not None else 'n/a'} ms"
+                f"{'' if stats['saved_measured'] else ' estimated'})")
+    return stats
+
+def _page_signals(driver):
+    """
+    Reads what the screenshot cannot show from the loaded page: title, final URL,
+    cookie-overlay coverage, and a compact "page" dict with load timings, metadata,
+    image alt-text coverage and the visible text.
+    """
+    try:
+        coverage = driver.execute_script(OVERLAY_COVERAGE_JS) or 0
+    except Exception:
+        coverage = 0
+    try:
+        page = driver.execute_script(PAGE_SIGNALS_JS, PAGE_TEXT_CHARS, OUTLINE_ITEMS)
+    except Exception as e:
+        logger.warning(f"Could not read page signals: {str(e)}")
+        page = {}
+    return {
+        "title": driver.title,
+        "final_url": driver.current_url,
+        "overlay_coverage": round(coverage, 2),
+        "page": page,
+    }
+
+def _capture_with_driver(driver, url, output_path, blocklist, image_format, quality, clip, mobile, time_budget,
+                         dismiss_overlays=False, settle=0):
+    start_time = time.time()
+    deadline = start_time + time_budget
+    # Always reset blocking so a pooled driver never inherits another capture's setting.
+    if blocklist or HAR_RECORD_DIR:
+        driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocklist or []})
+    _network_events(driver)
+
+    load_ms, timed_out = _navigate(driver, url, deadline)
+    if timed_out:
+        logger.warning(f"Time budget of {time_budget:.0f}s ran out loading {url}, capturing what has rendered")
+    if settle:
+        time.sleep(min(settle, max(0, _remaining(deadline) - SCREENSHOT_RESERVE)))
+    overlays_dismissed = 0
+    if dismiss_overlays:
+        overlays_dismissed = driver.execute_script(DISMISS_OVERLAYS_JS) or 0
+        if overlays_dismissed:
+            time.sleep(DISMISS_SETTLE)
+    signals = _page_signals(driver)
+    image_b64 = take_screenshot(driver, image_format, quality, clip)
+    if output_path:
+        _save_async(output_path, image_b64)
+    record = {
+        "url": url,
+        "path": output_path,
+        "load_ms": round(load_ms),
+        "image_b64": image_b64,
+        "mime": IMAGE_MIME_TYPES[image_format],
+        "timed_out": timed_out,
+        **signals,
+        "overlays_dismissed": overlays_dismissed,
+        "settled": bool(settle),
+    }
+    # Read network events before the mobile reload adds its own.
+    events = _network_events(driver)
+    record["page"].update(_network_totals(events))
+    blocked = _blocked_requests(events) if blocklist else []
+    # Record mode: bodies must be read back before the mobile reload replaces the page.
+    traffic = record_entries(driver, events) if HAR_RECORD_DIR else []
+
+    if mobile and _remaining(deadline) < MIN_MOBILE_BUDGET:
+        logger.warning(f"No time left for a mobile capture of {url}")
+    elif mobile:
+        record["mobile_image_b64"] = _capture_mobile(driver, url, image_format, quality, deadline)
+        record["mobile_path"] = mobile_screenshot_path(output_path) if output_path else None
+        if output_path:
+            _save_async(record["mobile_path"], record["mobile_image_b64"])
+        if HAR_RECORD_DIR:
+            traffic += record_entries(driver, _network_events(driver))
+    if HAR_RECORD_DIR:
+        save_har(har_path(HAR_RECORD_DIR, url), url, traffic)
+
+    record["elapsed_ms"] = round((time.time() - start_time) * 1000)
+    if blocklist:
+        record.update(_blocking_stats(driver, url, blocked, load_ms, timed_out, time_budget))
+    return record
+
+def capture_screenshot(url, output_path="screenshot.png", pool=None, block_requests=BLOCK_THIRD_PARTY,
+                       blocklist=None, image_format=CAPTURE_FORMAT, quality=CAPTURE_QUALITY, clip=None,
+                       mobile=CAPTURE_MOBILE, time_budget=SITE_TIME_BUDGET, dismiss_overlays=False, settle=0):
+    """
+    Navigates a headless Chrome browser to the given URL and takes a screenshot.
+
+    The encoded image comes straight from DevTools and is returned in memory; writing it
+    to output_path happens on a background thread (see wait_for_saves).
+
+    :param url: The URL of the website to capture.
+    :param output_path: The filename where the screenshot will be saved, or None to skip saving.
+    :param pool: Optional BrowserPool to borrow a warm browser from. Without one a
+                 fresh browser is launched for this capture and quit afterwards.
+    :param block_requests: Drop tracker, ad and chat-widget requests while loading.
+    :param blocklist: URL patterns to block; defaults to load_blocklist().
+    :param image_format: "png", "jpeg" or "webp".
+    :param quality: Compression quality for jpeg and webp.
+    :param clip: Optional region dict (x, y, width, height) to capture instead of the viewport.
+    :param mobile: Also capture the page on an emulated phone in the same session.
+    :param time_budget: Seconds for navigation, readiness and screenshots. When it runs out the
+                        page load is stopped and whatever has rendered is captured.
+    :param dismiss_overlays: Click "accept" on cookie/consent overlays (or remove them) before the screenshot.
+    :param settle: Extra seconds to let the page render before the screenshot, within the budget.
+    :return: A capture record with the url, path, load_ms, elapsed_ms, timed_out, image_b64 and mime,
+             the page title, final_url, overlay_coverage, overlays_dismissed and settled, page (load
+             timings, request count, transfer size, metadata, alt-text coverage and visible text), plus
+             mobile_image_b64 and mobile_path when mobile is on, plus
+             blocked_requests, blocked_hosts, saved_ms and saved_measured when blocking is on.
+    """
+    if image_format not in IMAGE_MIME_TYPES:
+        raise ValueError(f"Unsupported screenshot format: {image_format}")
+    if block_requests and blocklist is None:
+        blocklist = load_blocklist()
+    if not block_requests:
+        blocklist = None
+
+    if pool is not None:
+        with pool.driver() as driver:
+            return _capture_with_driver(driver, url, output_path, blocklist, image_format, quality, clip, mobile,
+                                        time_budget, dismiss_overlays, settle)
+
+    driver = create_driver()
+    try:
+        return _capture_with_driver(driver, url, output_path, blocklist, image_format, quality, clip, mobile,
+                                    time_budget, dismiss_overlays, settle)
+    finally:
+        close_driver(driver)
 
 # For standalone testing (optional)
 if __name__ == "__main__":
     test_url = "https://example.com"
     capture_screenshot(test_url)
+    wait_for_saves()
     print(f"Screenshot captured and saved as screenshot.png")
@@ -0,0 +1,105 @@
+#screenshot_clusters.py
+
+import io
+import os
+import json
+import base64
+import logging
+import threading
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Classify one site per group of near-identical screenshots (same template, franchise pages).
+# Off by default: sparse, mostly white pages hash close together even when they are different sites.
+CLUSTER_SCREENSHOTS = os.getenv("CLUSTER_SCREENSHOTS", "0") == "1"
+# Differing bits (out of HASH_SIZE * HASH_SIZE) up to which two screenshots count as the same page.
+CLUSTER_MAX_DISTANCE = int(os.getenv("CLUSTER_MAX_DISTANCE", "8"))
+HASH_SIZE = 16
+
+def perceptual_hash(image_b64, size=HASH_SIZE):
+    """
+    Difference hash of a screenshot: one bit per pixel of a (size+1) x size grayscale
+    thumbnail, set where the pixel is brighter than its right-hand neighbour. Small
+    changes in text, colour or compression flip few bits; a different layout flips many.
+    """
+    image = Image.open(io.BytesIO(base64.b64decode(image_b64))).convert("L").resize((size + 1, size))
+    pixels = list(image.getdata())
+    bits = 0
+    for row in range(size):
+        for column in range(size):
+            left = pixels[row * (size + 1) + column]
+            right = pixels[row * (size + 1) + column + 1]
+            bits = (bits << 1) | (left > right)
+    return bits
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+def normalize_title(title):
+    return " ".join((title or "").lower().split())
+
+class ScreenshotClusters:
+    """
+    Groups screenshots online, as captures arrive.
+
+    The first screenshot of a group becomes its representative and carries a value
+    (e.g. the future of its classification); later screenshots within max_distance of
+    a representative, with the same page title, join that group and get its value
+    instead of their own.
+    """
+
+    def __init__(self, max_distance=CLUSTER_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self._clusters = []
+        self._lock = threading.Lock()
+
+    def match(self, site, image_b64, title=None):
+        """
+        Adds site to the closest group within max_distance whose representative has the same title.
+
+        :return: That group's value, or None if no group is close enough (or the
+                 screenshot cannot be hashed).
+        """
+        try:
+            bits = perceptual_hash(image_b64)
+        except Exception as e:
+            logger.warning(f"Could not hash screenshot of {site}: {str(e)}")
+            return None
+        title = normalize_title(title)
+        with self._lock:
+            candidates = [c for c in self._clusters if c["title"] == title]
+            best = min(candidates, key=lambda c: hamming(c["hash"], bits), default=None)
+            if best is None or hamming(best["hash"], bits) > self.max_distance:
+                return None
+            best["members"].append({"site": site, "distance": hamming(best["hash"], bits)})
+        logger.info(f"{site} looks like {best['representative']}, reusing its classification")
+        return best["value"]
+
+    def add(self, site, image_b64, value, title=None):
+        """Starts a group represented by site."""
+        try:
+            bits = perceptual_hash(image_b64)
+        except Exception:
+            return
+        with self._lock:
+            self._clusters.append({"representative": site, "hash": bits, "title": normalize_title(title),
+                                   "value": value, "members": []})
+
+    def report(self):
+        """Groups with at least one member besides the representative, largest first."""
+        with self._lock:
+            groups = [{"representative": c["representative"], "hash": f"{c['hash']:064x}", "members": c["members"]}
+                      for c in self._clusters if c["members"]]
+        return sorted(groups, key=lambda g: len(g["members"]), reverse=True)
+
+    def save_report(self, path):
+        """Writes report() as JSON for auditing; returns the number of API calls saved."""
+        groups = self.report()
+        saved = sum(len(g["members"]) for g in groups)
+        if groups:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(groups, f, indent=2)
+            logger.info(f"Screenshot clustering: {saved} sites reused the verdict of "
+                        f"{len(groups)} look-alikes, see {path}")
+        return saved
@@ -1,4 +1,5 @@
 import os
+import sys
 import time
 import logging
 from selenium import webdriver
@@ -7,8 +8,9 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
 from dotenv import load_dotenv
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))  # Add parent directory to path to import driver_registry
+from driver_registry import resolve_chromedriver
 
 # Load environment variables
 load_dotenv()
@@ -205,7 +207,7 @@ def capture_semrush_report(domain, output_dir="semrush_reports", headless=False)
     options.add_argument("--disable-dev-shm-usage")
     
     try:
-        driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+        driver = webdriver.Chrome(service=Service(resolve_chromedriver()), options=options)
         
         # First, log in to SEMRush
         if not login_to_semrush(driver):
@@ -0,0 +1,107 @@
+#text_first.py
+
+import os
+import json
+import hashlib
+import logging
+from image_preprocess import preprocess_image
+from screenshot_capture import DESKTOP_WIDTH, DESKTOP_HEIGHT, MOBILE_WIDTH, MOBILE_HEIGHT
+
+logger = logging.getLogger(__name__)
+
+# Classify from the page text and outline plus low-detail thumbnails instead of full screenshots.
+TEXT_FIRST_MODE = os.getenv("TEXT_FIRST_MODE", "0") == "1"
+# Thumbnails fit in one 512px low-detail tile (85 tokens each).
+THUMBNAIL_WIDTH = 512
+THUMBNAIL_QUALITY = 70
+
+def render_outline(page):
+    """The page outline from the capture's page signals, one line per element in page order."""
+    lines = []
+    for item in page.get("outline") or []:
+        text = f": {item['text']}" if item.get("text") else ""
+        lines.append(f"- {item['tag']} at {item['top']}px{text}")
+    return "\n".join(lines)
+
+def page_digest(page):
+    """
+    Hash of the visible text and the outline of a page, for the cache key of a text-first
+    request (cache_key() only covers the images). Outline offsets are left out: they shift
+    between loads of an unchanged page as late images arrive.
+    """
+    outline = [(item.get("tag"), item.get("text")) for item in page.get("outline") or []]
+    content = json.dumps({"text": page.get("text") or "", "outline": outline}, sort_keys=True)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def make_thumbnails(capture):
+    """
+    Low-detail JPEG thumbnails of the first screen of a capture's desktop and (if present)
+    mobile screenshot.
+
+    :return: (desktop, mobile or None) preprocess_image results.
+    """
+    desktop = preprocess_image(capture["image_b64"], capture["mime"], max_width=THUMBNAIL_WIDTH,
+                               image_format="jpeg", quality=THUMBNAIL_QUALITY,
+                               fold_ratio=DESKTOP_HEIGHT / DESKTOP_WIDTH, detail="low")
+    mobile = None
+    if capture.get("mobile_image_b64"):
+        mobile = preprocess_image(capture["mobile_image_b64"], capture["mime"], max_width=THUMBNAIL_WIDTH,
+                                  image_format="jpeg", quality=THUMBNAIL_QUALITY,
+                                  fold_ratio=MOBILE_HEIGHT / MOBILE_WIDTH, detail="low")
+    return desktop, mobile
+
+def log_text_first_summary(stats):
+    """Totals of the per-site text-first stats recorded on each capture."""
+    stats = [s for s in stats if s]
+    if not stats:
+        return
+    tokens = sum(s["tokens"] for s in stats)
+    saved = sum(s["tokens_saved"] for s in stats)
+    logger.info(f"Text-first mode: about {tokens} prompt tokens for {len(stats)} sites, "
+                f"{saved} fewer than with full screenshots")
+
+if __name__ == "__main__":
+    # A/B run: capture the given sites, classify each from its full screenshots and from its
+    # text plus thumbnails, and report verdict agreement, prompt tokens and latency per site.
+    import sys
+    import json
+    if len(sys.argv) < 2:
+        print("Usage: python3 text_first.py <url or file of urls> ...")
+        sys.exit(1)
+    from browser_pool import BrowserPool
+    from screenshot_capture import capture_screenshot, CAPTURE_FORMAT, IMAGE_EXTENSIONS
+    from classify_website import init_clients, build_messages, build_text_messages, compare_requests
+    init_clients()
+    urls = []
+    for arg in sys.argv[1:]:
+        if os.path.isfile(arg):
+            with open(arg, encoding="utf-8") as f:
+                urls += [line.strip() for line in f if line.strip()]
+        else:
+            urls.append(arg)
+
+    os.makedirs("text_first_ab", exist_ok=True)
+    pairs = []
+    pool = BrowserPool()
+    try:
+        for i, url in enumerate(urls, start=1):
+            try:
+                screenshot_file = os.path.join("text_first_ab", f"screenshot_{i}{IMAGE_EXTENSIONS[CAPTURE_FORMAT]}")
+                capture = capture_screenshot(url, screenshot_file, pool=pool)
+            except Exception as e:
+                logger.error(f"Capture failed for {url}: {str(e)}")
+                continue
+            if not (capture.get("page") or {}).get("text"):
+                logger.warning(f"No page text for {url}, leaving it out")
+                continue
+            desktop, mobile = make_thumbnails(capture)
+            pairs.append((
+                url,
+                build_messages(capture["image_b64"], capture["mime"], capture.get("mobile_image_b64"),
+                               capture.get("page")),
+                build_text_messages(capture["page"], desktop["image_b64"], desktop["mime"],
+                                    mobile and mobile["image_b64"]),
+            ))
+    finally:
+        pool.close()
+    print(json.dumps(compare_requests(pairs, per_site=True), indent=2))
@@ -0,0 +1,139 @@
+#usage_ledger.py
+
+import json
+import math
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# USD per million (prompt, completion) tokens; check the pricing page and update when it changes.
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4": (30.00, 60.00),
+    "gpt-4-turbo": (10.00, 30.00),
+}
+# Batch API requests are billed at half price.
+BATCH_DISCOUNT = 0.5
+
+def call_cost(model, prompt_tokens, completion_tokens, batch=False):
+    """Cost of one call in USD, or None for a model without a price."""
+    if not model:
+        return None
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        # Dated snapshots (gpt-4o-2024-08-06) are priced like their family.
+        prices = next((p for name, p in sorted(MODEL_PRICES.items(), key=lambda item: -len(item[0]))
+                       if model.startswith(name + "-")), None)
+    if prices is None:
+        return None
+    cost = (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1_000_000
+    return cost * BATCH_DISCOUNT if batch else cost
+
+def percentile(values, p):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered), math.ceil(p / 100 * len(ordered))) - 1)]
+
+class UsageLedger:
+    """
+    One entry per model call: stage, model, tokens, cost, latency, retries and outcome.
+
+    record() is safe to call from any thread (the engine's event loop, the Batch API
+    job, the main thread). summary() aggregates the run as a whole and per stage.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self._lock = threading.Lock()
+
+    def record(self, stage, model, prompt_tokens=0, completion_tokens=0, image_tokens=None, seconds=None,
+               waited=None, retries=0, hedged=False, batch=False, estimated=False, error=None, cancelled=False):
+        """
+        Adds a call to the ledger.
+
+        :param stage: What the call was for, e.g. "classify" or "company_name".
+        :param image_tokens: Estimated part of prompt_tokens spent on images.
+        :param seconds: Latency of the attempt that answered (None for Batch API requests).
+        :param waited: Seconds spent before that attempt: rate limiting, backoff, failed attempts.
+        :param estimated: Token counts are estimates (streamed answers carry no usage).
+        :param error: Why the call failed, for calls that never returned an answer.
+        :param cancelled: The losing duplicate of a hedged request, cancelled after the other
+                          answered (its prompt is billed all the same).
+        """
+        entry = {
+            "time": time.time(),
+            "stage": stage,
+            "model": model,
+            "prompt_tokens": prompt_tokens or 0,
+            "completion_tokens": completion_tokens or 0,
+            "image_tokens": image_tokens,
+            "cost": call_cost(model, prompt_tokens or 0, completion_tokens or 0, batch),
+            "seconds": None if seconds is None else round(seconds, 3),
+            "waited": None if waited is None else round(waited, 3),
+            "retries": retries,
+            "hedged": hedged,
+            "batch": batch,
+            "estimated": estimated,
+            "error": error,
+            "cancelled": cancelled,
+        }
+        with self._lock:
+            self.entries.append(entry)
+
+    @staticmethod
+    def _aggregate(entries):
+        latencies = [e["seconds"] for e in entries
+                     if e["seconds"] is not None and not e["error"] and not e["cancelled"]]
+        costs = [e["cost"] for e in entries if e["cost"] is not None]
+        totals = {
+            "calls": len(entries),
+            "failed": sum(1 for e in entries if e["error"]),
+            "cancelled": sum(1 for e in entries if e["cancelled"]),
+            "retries": sum(e["retries"] or 0 for e in entries),
+            "prompt_tokens": sum(e["prompt_tokens"] for e in entries),
+            "image_tokens": sum(e["image_tokens"] or 0 for e in entries),
+            "completion_tokens": sum(e["completion_tokens"] for e in entries),
+            "cost": round(sum(costs), 4),
+            "seconds": round(sum(latencies), 2),
+        }
+        if latencies:
+            totals.update({f"p{p}": round(percentile(latencies, p), 2) for p in (50, 95, 99)})
+        return totals
+
+    def summary(self):
+        """Totals for the run and per stage (calls, tokens, cost, latency percentiles)."""
+        with self._lock:
+            entries = list(self.entries)
+        stages = {}
+        for entry in entries:
+            stages.setdefault(entry["stage"], []).append(entry)
+        return {
+            "total": self._aggregate(entries),
+            "stages": {stage: self._aggregate(items) for stage, items in sorted(stages.items())},
+        }
+
+    def log_summary(self):
+        summary = self.summary()
+        if not summary["total"]["calls"]:
+            return
+        for name, totals in [("all calls", summary["total"])] + list(summary["stages"].items()):
+            latency = (f", latency p50/p95/p99 {totals['p50']}/{totals['p95']}/{totals['p99']}s"
+                       if "p50" in totals else "")
+            logger.info(f"Usage ({name}): {totals['calls']} calls ({totals['failed']} failed, "
+                        f"{totals['cancelled']} cancelled hedges, {totals['retries']} retries), "
+                        f"{totals['prompt_tokens']} prompt tokens (~{totals['image_tokens']} for images), "
+                        f"{totals['completion_tokens']} completion tokens, "
+                        f"${totals['cost']:.4f}{latency}")
+
+    def save(self, path):
+        """Writes the summary and every entry as JSON."""
+        with self._lock:
+            entries = list(self.entries)
+        if not entries:
+            return
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"summary": self.summary(), "calls": entries}, f, indent=2)
+        logger.info(f"Usage ledger with {len(entries)} calls written to {path}")
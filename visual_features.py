@@ -0,0 +1,209 @@
+#visual_features.py
+
+import io
+import os
+import re
+import base64
+import logging
+import threading
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Screenshots are reduced to this width before their profile is computed.
+PROFILE_WIDTH = 320
+# Side of the square blocks used for the whitespace and text-region measures, in thumbnail pixels.
+BLOCK = 8
+# Lead filter and ranking for the CSV report, e.g. LEAD_FILTER="whitespace_ratio<0.4;palette_entropy>3"
+# and LEAD_RANK_BY="-edge_density" (a leading "-" ranks the highest values first).
+LEAD_FILTER = os.getenv("LEAD_FILTER", "")
+LEAD_RANK_BY = os.getenv("LEAD_RANK_BY", "")
+
+FEATURE_NAMES = (
+    "whitespace_ratio",    # share of blocks with no visible detail
+    "color_count",         # distinct colours at 4 bits per channel
+    "palette_entropy",     # Shannon entropy of those colours, in bits
+    "contrast_std",        # RMS contrast of the luminance
+    "contrast_range",      # 5th to 95th percentile luminance spread
+    "edge_density",        # share of pixels on an edge
+    "text_fraction",       # share of blocks that look like text (dense, high-contrast edges)
+    "dominant_hue",        # centre of the most common hue bin in degrees, -1 for greyscale pages
+    "dominant_hue_share",  # that bin's share of the colourful pixels
+)
+HUE_BINS = 12
+
+def visual_profile(image_b64, width=PROFILE_WIDTH):
+    """
+    Numeric profile of a screenshot, in FEATURE_NAMES order.
+
+    All measures are whole-array NumPy operations on a thumbnail PROFILE_WIDTH wide;
+    most of the time per screenshot goes into decoding it.
+    """
+    image = Image.open(io.BytesIO(base64.b64decode(image_b64))).convert("RGB")
+    height = max(BLOCK, round(image.height * width / image.width)) // BLOCK * BLOCK
+    image = image.resize((width // BLOCK * BLOCK, height), Image.BILINEAR)
+    rgb = np.asarray(image, dtype=np.float32) / 255
+    hsv = np.asarray(image.convert("HSV"), dtype=np.float32) / 255
+    gray = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+    rows, columns = gray.shape[0] // BLOCK, gray.shape[1] // BLOCK
+    block_std = gray.reshape(rows, BLOCK, columns, BLOCK).std(axis=(1, 3))
+
+    gradient = np.zeros_like(gray)
+    gradient[:, :-1] += np.abs(np.diff(gray, axis=1))
+    gradient[:-1, :] += np.abs(np.diff(gray, axis=0))
+    edges = gradient > 0.1
+    block_edges = edges.reshape(rows, BLOCK, columns, BLOCK).mean(axis=(1, 3))
+
+    quantized = (rgb * 15).astype(np.int32)
+    codes = quantized[..., 0] * 256 + quantized[..., 1] * 16 + quantized[..., 2]
+    counts = np.bincount(codes.ravel(), minlength=4096)
+    shares = counts[counts > 0] / codes.size
+
+    hue, saturation, value = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    colourful = (saturation > 0.2) & (value > 0.2)
+    if colourful.any():
+        hue_counts = np.bincount((hue[colourful] * HUE_BINS).astype(np.int32).clip(0, HUE_BINS - 1),
+                                 minlength=HUE_BINS)
+        dominant = int(hue_counts.argmax())
+        dominant_hue, dominant_share = (dominant + 0.5) * 360 / HUE_BINS, hue_counts[dominant] / colourful.sum()
+    else:
+        dominant_hue, dominant_share = -1.0, 0.0
+
+    low, high = np.percentile(gray, [5, 95])
+    return np.array([
+        np.mean(block_std < 0.02),
+        len(shares),
+        -np.sum(shares * np.log2(shares)),
+        gray.std(),
+        high - low,
+        edges.mean(),
+        np.mean((block_edges > 0.15) & (block_std > 0.08)),
+        dominant_hue,
+        dominant_share,
+    ], dtype=np.float32)
+
+class FeatureTable:
+    """
+    Visual profiles keyed by site: one float32 row per site, columns in FEATURE_NAMES order.
+
+    Saved as a compressed .npz with the site list and the feature matrix, so a run's
+    leads can be ranked and filtered later without decoding any screenshot again.
+    Safe to add to from several threads.
+    """
+
+    def __init__(self):
+        self._index = {}
+        self._rows = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, site, image_b64):
+        """Computes and stores the profile of site's screenshot; returns False if it cannot be read."""
+        try:
+            profile = visual_profile(image_b64)
+        except Exception as e:
+            logger.warning(f"Could not profile screenshot of {site}: {str(e)}")
+            return False
+        with self._lock:
+            if site in self._index:
+                self._rows[self._index[site]] = profile
+            else:
+                self._index[site] = len(self._rows)
+                self._rows.append(profile)
+        return True
+
+    def matrix(self):
+        """(sites, features): the site list and the float32 matrix of their profiles."""
+        with self._lock:
+            sites = sorted(self._index, key=self._index.get)
+            rows = list(self._rows)
+        return sites, np.array(rows, dtype=np.float32).reshape(len(rows), len(FEATURE_NAMES))
+
+    def get(self, site):
+        """site's profile as a {feature: value} dict, or None."""
+        with self._lock:
+            if site not in self._index:
+                return None
+            row = self._rows[self._index[site]]
+        return {name: round(float(value), 4) for name, value in zip(FEATURE_NAMES, row)}
+
+    def save(self, path):
+        sites, features = self.matrix()
+        np.savez_compressed(path, sites=np.array(sites), features=features, names=np.array(FEATURE_NAMES))
+        logger.info(f"Saved visual profiles of {len(sites)} sites to {path}")
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        names = [str(n) for n in data["names"]]
+        if tuple(names) != FEATURE_NAMES:
+            raise ValueError(f"{path} holds other features ({', '.join(names)})")
+        table = cls()
+        table._rows = list(data["features"])
+        table._index = {str(site): i for i, site in enumerate(data["sites"])}
+        return table
+
+def parse_lead_filter(spec):
+    """LEAD_FILTER conditions as (feature, operator, value) tuples."""
+    conditions = []
+    for part in filter(None, (p.strip() for p in spec.split(";"))):
+        match = re.fullmatch(r"(\w+)\s*(<=|>=|<|>)\s*(-?[\d.]+)", part)
+        if not match or match.group(1) not in FEATURE_NAMES:
+            raise ValueError(f"Invalid lead filter condition: {part}")
+        conditions.append((match.group(1), match.group(2), float(match.group(3))))
+    return conditions
+
+# Bad settings fail at startup rather than when the report is written at the end of a run
+parse_lead_filter(LEAD_FILTER)
+if LEAD_RANK_BY.lstrip("-") and LEAD_RANK_BY.lstrip("-") not in FEATURE_NAMES:
+    raise ValueError(f"Unknown ranking feature: {LEAD_RANK_BY}")
+
+OPERATORS = {"<": np.less, "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal}
+
+def select_leads(sites, table, lead_filter=LEAD_FILTER, rank_by=LEAD_RANK_BY):
+    """
+    Applies the lead filter and ranking to sites using their stored profiles.
+
+    Sites without a profile are kept and placed after the ranked ones.
+
+    :return: The selected sites in report order.
+    """
+    conditions = parse_lead_filter(lead_filter)
+    descending = rank_by.startswith("-")
+    rank_by = rank_by.lstrip("-")
+    if rank_by and rank_by not in FEATURE_NAMES:
+        raise ValueError(f"Unknown ranking feature: {rank_by}")
+    all_sites, features = table.matrix()
+    positions = {site: i for i, site in enumerate(all_sites)}
+    profiled = [s for s in sites if s in positions]
+    rows = features[[positions[s] for s in profiled]] if profiled else features[:0]
+    keep = np.ones(len(profiled), dtype=bool)
+    for name, operator, value in conditions:
+        keep &= OPERATORS[operator](rows[:, FEATURE_NAMES.index(name)], value)
+    order = np.nonzero(keep)[0]
+    if rank_by:
+        values = rows[order, FEATURE_NAMES.index(rank_by)]
+        order = order[np.argsort(-values if descending else values, kind="stable")]
+    return [profiled[i] for i in order] + [s for s in sites if s not in positions]
+
+if __name__ == "__main__":
+    # Builds a feature table for a directory of saved screenshots.
+    import sys
+    import glob
+    import time
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2:
+        print("Usage: python3 visual_features.py <screenshots_dir> [output.npz]")
+        sys.exit(1)
+    files = sorted(f for f in glob.glob(os.path.join(sys.argv[1], "screenshot_*")) if "_mobile." not in f)
+    table = FeatureTable()
+    start_time = time.time()
+    for path in files:
+        with open(path, "rb") as f:
+            table.add(os.path.basename(path), base64.b64encode(f.read()).decode("ascii"))
+    logger.info(f"Profiled {len(table)} screenshots in {time.time() - start_time:.2f} seconds")
+    table.save(sys.argv[2] if len(sys.argv) > 2 else os.path.join(sys.argv[1], "features.npz"))